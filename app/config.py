@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import Literal
 
 from pydantic import SecretStr, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -27,7 +28,11 @@ class PostgresSettings(ConfigBase):
 class ImgbbSettings(ConfigBase):
     model_config = SettingsConfigDict(env_prefix='IMGBB_')
     API_KEY: SecretStr
+    BASE_URL: str = 'https://api.imgbb.com/1'
+    CONNECT_TIMEOUT_SECONDS: float = 5
+    READ_TIMEOUT_SECONDS: float = 30
     REQUEST_TIMEOUT_SECONDS: int = 60
+    MAX_ATTEMPTS: int = 3
 
 
 class CloudflareSettings(ConfigBase):
@@ -38,7 +43,71 @@ class CloudflareSettings(ConfigBase):
     TAGS_MODEL_NAME: str = '@cf/meta/llama-4-scout-17b-16e-instruct'
     IMAGE_HEIGHT: int = 1024
     IMAGE_WIDTH: int = 768
+    BASE_URL: str = 'https://api.cloudflare.com/client/v4'
+    CONNECT_TIMEOUT_SECONDS: float = 5
+    READ_TIMEOUT_SECONDS: float = 60
     REQUEST_TIMEOUT_SECONDS: int = 60
+    IMAGES_MAX_ATTEMPTS: int = 2
+    TAGS_MAX_ATTEMPTS: int = 3
+    TAGS_HEDGE_DELAY_SECONDS: float = 0
+
+
+class StorageSettings(ConfigBase):
+    model_config = SettingsConfigDict(env_prefix='STORAGE_')
+    BACKEND: Literal['imgbb', 'local'] = 'imgbb'
+    LOCAL_DIRECTORY: str = f'{BASE_DIR}/media'
+    PUBLIC_URL: str = '/media'
+
+
+class HttpClientSettings(ConfigBase):
+    model_config = SettingsConfigDict(env_prefix='HTTP_CLIENT_')
+    POOL_LIMIT: int = 100
+    POOL_LIMIT_PER_HOST: int = 20
+    KEEPALIVE_TIMEOUT_SECONDS: int = 30
+    DNS_CACHE_TTL_SECONDS: int = 300
+    RETRY_BACKOFF_SECONDS: float = 0.5
+    RETRY_MAX_BACKOFF_SECONDS: float = 10
+    BREAKER_FAILURE_THRESHOLD: int = 5
+    BREAKER_RESET_SECONDS: float = 30
+
+
+class GenerationSettings(ConfigBase):
+    model_config = SettingsConfigDict(env_prefix='GENERATION_')
+    WORKERS: int = 4
+    MAX_JOBS_PER_USER: int = 3
+    MAX_QUEUED_JOBS: int = 100
+    RATE_PER_SECOND: float = 0
+    RATE_BURST: int = 5
+    MAX_BATCH_SIZE: int = 3
+    JOB_BACKEND: Literal['database', 'memory'] = 'database'
+    JOBS_RETENTION_HOURS: int = 24
+    TAGS_TIMEOUT_SECONDS: int = 30
+    CACHE_TTL_SECONDS: int = 3600
+    CACHE_MAX_SIZE: int = 1000
+    THUMBNAIL_WIDTH: int = 384
+    VARIANTS_QUALITY: int = 80
+
+
+class LikesSettings(ConfigBase):
+    model_config = SettingsConfigDict(env_prefix='LIKES_')
+    WRITE_BEHIND: bool = False
+    FLUSH_INTERVAL_SECONDS: float = 1
+
+
+class TrendingSettings(ConfigBase):
+    model_config = SettingsConfigDict(env_prefix='TRENDING_')
+    HALF_LIFE_HOURS: float = 24
+    UPDATE_INTERVAL_MINUTES: int = 5
+
+
+class CacheSettings(ConfigBase):
+    model_config = SettingsConfigDict(env_prefix='CACHE_')
+    USER_TTL_SECONDS: int = 60
+    USER_MAX_SIZE: int = 10000
+    GALLERY_TTL_SECONDS: int = 5
+    GALLERY_MAX_SIZE: int = 1000
+    FRAGMENT_TTL_SECONDS: int = 600
+    FRAGMENT_MAX_SIZE: int = 1000
 
 
 class AuthSettings(ConfigBase):
@@ -49,13 +118,23 @@ class AuthSettings(ConfigBase):
     ALGORITHM: str = 'HS256'
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
+    HASHING_EXECUTOR: Literal['thread', 'process'] = 'thread'
+    HASHING_WORKERS: int = 2
+    LOGIN_RATE_LIMIT_ATTEMPTS: int = 0
+    LOGIN_RATE_LIMIT_WINDOW_SECONDS: int = 60
 
 
 class Settings(ConfigBase):
     POSTGRES: PostgresSettings = Field(default_factory=PostgresSettings)
     IMGBB: ImgbbSettings = Field(default_factory=ImgbbSettings)
     CLOUDFLARE: CloudflareSettings = Field(default_factory=CloudflareSettings)
+    STORAGE: StorageSettings = Field(default_factory=StorageSettings)
     AUTH: AuthSettings = Field(default_factory=AuthSettings)
+    HTTP_CLIENT: HttpClientSettings = Field(default_factory=HttpClientSettings)
+    GENERATION: GenerationSettings = Field(default_factory=GenerationSettings)
+    CACHE: CacheSettings = Field(default_factory=CacheSettings)
+    LIKES: LikesSettings = Field(default_factory=LikesSettings)
+    TRENDING: TrendingSettings = Field(default_factory=TrendingSettings)
     GENERATIONS_PER_DAY: int = 5
     TIME_ZONE: str = 'UTC'
     USE_SQLITE: bool = False
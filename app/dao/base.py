@@ -2,13 +2,23 @@ import uuid
 from typing import TypeVar, Generic, Sequence
 
 from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.config import SETTINGS
+from app.dao.load_profiles import LoadProfile
 from app.database import connection, Base
 
 T = TypeVar('T', bound=Base)
 
 
+# INSERT of the current database dialect, which supports ON CONFLICT clauses
+def insert_on_conflict(model: type[Base]) -> postgresql.Insert | sqlite.Insert:
+    if SETTINGS.USE_SQLITE:
+        return sqlite.insert(model)
+    return postgresql.insert(model)
+
+
 # DAO - Data Access Object
 class BaseDAO(Generic[T]):
     model: type[T]
@@ -20,24 +30,33 @@ class BaseDAO(Generic[T]):
         session.add(new_instance)
         return new_instance
 
+    # The instances are inserted with one statement
     @classmethod
     @connection
-    async def find_one_or_none_by_id(cls, data_id: uuid.UUID, session: AsyncSession) -> T | None:
-        record = await session.get(cls.model, data_id)
+    async def add_many(cls, values: list[dict], session: AsyncSession) -> list[T]:
+        new_instances = [cls.model(**instance_values) for instance_values in values]
+        session.add_all(new_instances)
+        return new_instances
+
+    @classmethod
+    @connection
+    async def find_one_or_none_by_id(cls, data_id: uuid.UUID, session: AsyncSession,
+                                     profile: LoadProfile = ()) -> T | None:
+        record = await session.get(cls.model, data_id, options=profile)
         return record
 
     @classmethod
     @connection
-    async def find_one_or_none(cls, session: AsyncSession, **filter_by) -> T | None:
-        query = select(cls.model).filter_by(**filter_by)
+    async def find_one_or_none(cls, session: AsyncSession, profile: LoadProfile = (), **filter_by) -> T | None:
+        query = select(cls.model).filter_by(**filter_by).options(*profile)
         result = await session.execute(query)
         record = result.scalar_one_or_none()
         return record
 
     @classmethod
     @connection
-    async def find_all(cls, session: AsyncSession, **filter_by) -> Sequence[T]:
-        query = select(cls.model).filter_by(**filter_by)
+    async def find_all(cls, session: AsyncSession, profile: LoadProfile = (), **filter_by) -> Sequence[T]:
+        query = select(cls.model).filter_by(**filter_by).options(*profile)
         result = await session.execute(query)
         records = result.scalars().all()
         return records
@@ -1,60 +1,236 @@
 import uuid
 from typing import Literal, Sequence
 
-from sqlalchemy import select, desc, asc, func, update
+from sqlalchemy import select, desc, asc, func, update, delete, insert, tuple_, case, Select, ColumnElement, literal, \
+    bindparam, union_all
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import SETTINGS
-from app.dao.base import BaseDAO
-from app.database import User, Image, Like, connection, Tag
+from app.dao.base import BaseDAO, insert_on_conflict
+from app.dao.load_profiles import LoadProfile, AUTH_USER
+from app.dao.search import search_prompts
+from app.database import User, Image, Like, connection, Tag, ImageTag, GenerationJob, GenerationJobStatus, JobState, \
+    RemovedLike, database_time_ago, call_after_commit
+from app.schemas import UserSnapshot
+from app.utils.cache import TTLCache, ResultCacheBackend, MemoryResultCacheBackend
+from app.utils.pagination import encode_cursor, decode_cursor
+from app.utils.trending import get_like_weight, add_weights, subtract_weights
+
+# Snapshots of authenticated users by id. Writes through UserDAO invalidate them after the commit, changes made by
+# other processes become visible after the time to live
+user_cache: TTLCache[uuid.UUID, UserSnapshot] = TTLCache(SETTINGS.CACHE.USER_MAX_SIZE, SETTINGS.CACHE.USER_TTL_SECONDS)
+
+TRENDING_JOB_NAME = 'trending_scores'
+
+# Results of ImageDAO.find_all_with_filters
+gallery_cache: ResultCacheBackend = MemoryResultCacheBackend(SETTINGS.CACHE.GALLERY_MAX_SIZE,
+                                                             SETTINGS.CACHE.GALLERY_TTL_SECONDS)
+
+# Versions of the data the cached gallery results depend on. They are part of the cache keys and are incremented after
+# the commit of a change, so results read before the change are stored under the old version and never returned.
+# Like counters change often, so they invalidate only the results sorted by likes. Other results can show counters
+# outdated for the time to live of the cache
+gallery_versions = {'images': 0, 'likes': 0, 'trending': 0}
+
+
+def invalidate_gallery(session: AsyncSession, *changed: str) -> None:
+    def increment_versions() -> None:
+        for name in changed:
+            gallery_versions[name] += 1
+
+    call_after_commit(session, increment_versions)
 
 
 class UserDAO(BaseDAO[User]):
     model = User
 
+    @classmethod
+    async def find_snapshot_by_id(cls, user_id: uuid.UUID) -> UserSnapshot | None:
+        snapshot = user_cache.get(user_id)
+        if snapshot is None:
+            version = user_cache.version
+            user = await cls.find_one_or_none_by_id(user_id, profile=AUTH_USER)
+            if user is None:
+                return None
+            snapshot = UserSnapshot.model_validate(user)
+            user_cache.set(user_id, snapshot, version)
+        return snapshot
+
+    @classmethod
+    @connection
+    async def update_one_by_id(cls, data_id: uuid.UUID, session: AsyncSession, **update_values) -> None:
+        call_after_commit(session, lambda: user_cache.delete(data_id))
+        await super().update_one_by_id(data_id, session=session, **update_values)
+
+    @classmethod
+    @connection
+    async def delete_one_by_id(cls, data_id: uuid.UUID, session: AsyncSession) -> None:
+        call_after_commit(session, lambda: user_cache.delete(data_id))
+        invalidate_gallery(session, 'images', 'likes')
+        # Likes of the user are deleted by cascade, so the counters of the liked images must be decreased
+        # and the likes must be subtracted from the trending scores
+        liked_images = select(Like.to_image_id).where(Like.from_user_id == data_id)
+        await session.execute(insert(RemovedLike).from_select(
+            [RemovedLike.id, RemovedLike.image_id, RemovedLike.liked_at],
+            select(Like.id, Like.to_image_id, Like.created_at).where(Like.from_user_id == data_id)))
+        await session.execute(
+            update(Image).where(Image.id.in_(liked_images)).values(like_count=Image.like_count - 1))
+        await super().delete_one_by_id(data_id, session=session)
+
     @classmethod
     @connection
     async def update_daily_generations(cls, session: AsyncSession) -> None:
+        call_after_commit(session, user_cache.clear)
         await session.execute(update(User).values(generations_left=SETTINGS.GENERATIONS_PER_DAY))
 
+    # Takes generations from the user with a single statement, so concurrent requests cannot spend more than is left.
+    # Returns the number of generations left or None if there are not enough of them
     @classmethod
     @connection
-    async def decrease_generations_by_id(cls, user_id: uuid.UUID, session: AsyncSession) -> int | None:
-        user = await cls.find_one_or_none_by_id(user_id, session=session)
-        if user is None:
-            return None
-        user.generations_left -= 1
-        return int(user.generations_left)
+    async def reserve_generations_by_id(cls, user_id: uuid.UUID, session: AsyncSession, count: int = 1) -> int | None:
+        call_after_commit(session, lambda: user_cache.delete(user_id))
+        result = await session.execute(
+            update(User).where(User.id == user_id, User.generations_left >= count)
+            .values(generations_left=User.generations_left - count).returning(User.generations_left))
+        return result.scalar_one_or_none()
+
+    # Returns generations that were reserved but not used, without exceeding the daily limit
+    @classmethod
+    @connection
+    async def refund_generations_by_id(cls, user_id: uuid.UUID, session: AsyncSession, count: int = 1) -> None:
+        call_after_commit(session, lambda: user_cache.delete(user_id))
+        refunded = User.generations_left + count
+        await session.execute(update(User).where(User.id == user_id).values(
+            generations_left=case((refunded > SETTINGS.GENERATIONS_PER_DAY, SETTINGS.GENERATIONS_PER_DAY),
+                                  else_=refunded)))
 
 
 class ImageDAO(BaseDAO[Image]):
     model = Image
 
+    # Words of the term starting with # are tags, the rest is searched in prompts.
+    # Returns the filtered query and the relevance of the images for a text search
+    @classmethod
+    def filter_by_term(cls, query: Select, term: str | None,
+                       tag_mode: Literal['all', 'any'] = 'all') -> tuple[Select, ColumnElement | None]:
+        if term is None:
+            return query, None
+        words = term.split()
+        tag_names = list(dict.fromkeys(word.lower() for word in words if word.startswith('#')))
+        text = ' '.join(word for word in words if not word.startswith('#'))
+        if tag_names:
+            # Images are found through the (tag_id, image_id) index without joining them with tags
+            tagged_images = select(ImageTag.image_id).join(Tag, Tag.id == ImageTag.tag_id).where(
+                Tag.name.in_(tag_names))
+            if tag_mode == 'all' and len(tag_names) > 1:
+                tagged_images = tagged_images.group_by(ImageTag.image_id).having(func.count() == len(tag_names))
+            query = query.where(Image.id.in_(tagged_images))
+        if not text:
+            return query, None
+        return search_prompts(query, text)
+
+    # Search is case-insensitive and ignores extra whitespace, so such terms share the cached results
+    @classmethod
+    def normalize_term(cls, term: str | None) -> str | None:
+        if term is None:
+            return None
+        return ' '.join(term.lower().split()) or None
+
     @classmethod
     @connection
-    async def find_all_with_filters(cls, session: AsyncSession, sort_by: Literal['date', 'likes'] = 'likes',
-                                    order_by: Literal['asc', 'desc'] = 'desc', term: str = None, page: int = 1,
-                                    page_size: int = 9, **filter_by) -> tuple[Sequence[Image], int]:
-        query = select(Image).filter_by(**filter_by)
+    async def find_all_with_filters(cls, session: AsyncSession,
+                                    sort_by: Literal['date', 'likes', 'relevance', 'trending'] = 'likes',
+                                    order_by: Literal['asc', 'desc'] = 'desc', term: str = None,
+                                    tag_mode: Literal['all', 'any'] = 'all', page: int = 1, page_size: int = 9,
+                                    profile: LoadProfile = (), **filter_by) -> tuple[Sequence[Image], int]:
+        term = cls.normalize_term(term)
+        query, relevance = cls.filter_by_term(select(Image).filter_by(**filter_by), term, tag_mode)
         order_function = desc if order_by == 'desc' else asc
-        if term is not None:
-            if term.startswith('#'):
-                query = query.join(Image.tags).where(Tag.name == term)
-            else:
-                query = query.where(Image.prompt.contains(term))
-        if sort_by == 'date':
-            query = query.order_by(order_function(Image.created_at))
-        elif sort_by == 'likes':
-            query = query.outerjoin(Like).group_by(Image.id).order_by(order_function(func.count(Like.id)))
         count_query = select(func.count()).select_from(query.subquery())
+        # Name of the version of the counters the order depends on
+        order_version = None
+        if sort_by == 'relevance' and relevance is not None:
+            query = query.order_by(order_function(relevance), order_function(Image.created_at))
+        elif sort_by == 'date':
+            query = query.order_by(order_function(Image.created_at))
+        elif sort_by == 'trending':
+            query = query.order_by(order_function(Image.trending_score), order_function(Image.created_at))
+            order_version = 'trending'
+        else:
+            query = query.order_by(order_function(Image.like_count), order_function(Image.created_at))
+            order_version = 'likes'
+        cache_key = (gallery_versions['images'], gallery_versions.get(order_version),
+                     sort_by, order_by, term, tag_mode, page, page_size, tuple(profile),
+                     tuple(sorted(filter_by.items())))
+        cached = await gallery_cache.get(cache_key)
+        if cached is not None:
+            return cached
         total_results = await session.scalar(count_query)
         total_pages = (total_results + page_size - 1) // page_size
         offset = (page - 1) * page_size
-        paginated_query = query.offset(offset).limit(page_size)
+        paginated_query = query.offset(offset).limit(page_size).options(*profile)
         result = await session.execute(paginated_query)
         records = result.scalars().unique().all()
+        await gallery_cache.set(cache_key, (records, total_pages))
         return records, total_pages
 
+    # Keyset pagination: the cost of a page does not depend on its depth, and the total count is not calculated.
+    # Relevance is not a stored value, so sorting by it falls back to sorting by likes
+    @classmethod
+    @connection
+    async def find_all_by_cursor(cls, session: AsyncSession,
+                                 sort_by: Literal['date', 'likes', 'relevance', 'trending'] = 'likes',
+                                 order_by: Literal['asc', 'desc'] = 'desc', term: str = None,
+                                 tag_mode: Literal['all', 'any'] = 'all', cursor: str = None, page_size: int = 9,
+                                 profile: LoadProfile = (),
+                                 **filter_by) -> tuple[Sequence[Image], str | None, str | None]:
+        query, _ = cls.filter_by_term(select(Image).filter_by(**filter_by), term, tag_mode)
+        if sort_by == 'date':
+            key_columns = (Image.created_at, Image.id)
+        elif sort_by == 'trending':
+            key_columns = (Image.trending_score, Image.created_at, Image.id)
+        else:
+            key_columns = (Image.like_count, Image.created_at, Image.id)
+        decoded_cursor = decode_cursor(cursor, [column.type.python_type for column in key_columns])
+        backwards = decoded_cursor is not None and decoded_cursor.backwards
+        descending = (order_by == 'desc') != backwards
+        if decoded_cursor is not None:
+            key = tuple_(*key_columns)
+            bound = tuple(decoded_cursor.values)
+            query = query.where(key < bound if descending else key > bound)
+        order_function = desc if descending else asc
+        query = query.order_by(*(order_function(column) for column in key_columns))
+        result = await session.execute(query.limit(page_size + 1).options(*profile))
+        records = list(result.scalars().unique().all())
+        has_more = len(records) > page_size
+        records = records[:page_size]
+        if backwards:
+            records.reverse()
+        has_next = has_more if not backwards else True
+        has_prev = has_more if backwards else decoded_cursor is not None
+        next_cursor, prev_cursor = None, None
+        if records and has_next:
+            next_cursor = encode_cursor([getattr(records[-1], column.key) for column in key_columns])
+        if records and has_prev:
+            prev_cursor = encode_cursor([getattr(records[0], column.key) for column in key_columns], backwards=True)
+        return records, next_cursor, prev_cursor
+
+    # Gallery of the user from the newest images. Visibility is filtered in the query, so the cost of a page
+    # does not depend on the number of images of the user. Returns the images, the number of pages
+    # when paginated by page number and the next and previous cursors when paginated by cursor
+    @classmethod
+    async def find_all_by_author(cls, author_id: uuid.UUID, include_private: bool = False, page: int = 1,
+                                 cursor: str = None, page_size: int = 12, profile: LoadProfile = ()
+                                 ) -> tuple[Sequence[Image], int | None, str | None, str | None]:
+        filter_by = {} if include_private else {'is_public': True}
+        if cursor is not None:
+            records, next_cursor, prev_cursor = await cls.find_all_by_cursor(
+                sort_by='date', cursor=cursor, page_size=page_size, profile=profile, author_id=author_id, **filter_by)
+            return records, None, next_cursor, prev_cursor
+        records, total_pages = await cls.find_all_with_filters(
+            sort_by='date', page=page, page_size=page_size, profile=profile, author_id=author_id, **filter_by)
+        return records, total_pages, None, None
+
     @classmethod
     @connection
     async def change_visibility_by_id(cls, image_id: uuid.UUID, session: AsyncSession) -> bool | None:
@@ -62,25 +238,228 @@ class ImageDAO(BaseDAO[Image]):
         if image is None:
             return None
         image.is_public = not image.is_public
+        invalidate_gallery(session, 'images')
         return bool(image.is_public)
 
+    @classmethod
+    @connection
+    async def delete_one_by_id(cls, data_id: uuid.UUID, session: AsyncSession) -> None:
+        invalidate_gallery(session, 'images')
+        await super().delete_one_by_id(data_id, session=session)
+
+    # Images created before the variants were introduced, in batches ordered by id
+    @classmethod
+    @connection
+    async def find_all_without_variants(cls, session: AsyncSession, after_id: uuid.UUID | None = None,
+                                        limit: int = 100) -> Sequence[Image]:
+        query = select(Image).where(Image.thumb_url.is_(None)).order_by(Image.id).limit(limit)
+        if after_id is not None:
+            query = query.where(Image.id > after_id)
+        result = await session.execute(query)
+        return result.scalars().all()
+
     @classmethod
     @connection
     async def create_tags_for_image_by_id(cls, image_id: uuid.UUID, tag_names: list[str],
                                           session: AsyncSession) -> None:
-        image = await cls.find_one_or_none_by_id(image_id, session=session)
-        if image is None:
+        tag_ids = await TagDAO.add_many_by_names(tag_names, session=session)
+        if tag_ids:
+            await session.execute(insert(ImageTag),
+                                  [{'image_id': image_id, 'tag_id': tag_id} for tag_id in tag_ids.values()])
+
+    # Stores generated images with a statement for the images, one for the tags and one for the links between them.
+    # Each image is described by the values of its columns, including the author, and the names of its tags.
+    # Returns the ids of the images in the same order
+    @classmethod
+    @connection
+    async def add_many_generated(cls, images: list[dict], session: AsyncSession) -> list[uuid.UUID]:
+        if not images:
+            return []
+        invalidate_gallery(session, 'images')
+        image_ids = [uuid.uuid4() for _ in images]
+        # All rows of a multi-row insert must have the same columns
+        columns = set().union(*images) - {'tag_names'}
+        await session.execute(insert(Image), [
+            {'id': image_id, **{column: image.get(column) for column in columns}}
+            for image_id, image in zip(image_ids, images)])
+        tag_ids = await TagDAO.add_many_by_names([name for image in images for name in image['tag_names']],
+                                                 session=session)
+        image_tags = [{'image_id': image_id, 'tag_id': tag_ids[name]}
+                      for image_id, image in zip(image_ids, images) for name in dict.fromkeys(image['tag_names'])]
+        if image_tags:
+            await session.execute(insert(ImageTag), image_tags)
+        return image_ids
+
+    # Applies changes of like counters accumulated for many images. Images are updated in the order of their ids,
+    # so concurrent flushes cannot deadlock
+    @classmethod
+    @connection
+    async def add_to_like_counts(cls, deltas: dict[uuid.UUID, int], session: AsyncSession) -> None:
+        deltas = {image_id: delta for image_id, delta in sorted(deltas.items()) if delta != 0}
+        if not deltas:
             return
-        for tag_name in tag_names:
-            tag = await TagDAO.find_one_or_none(name=tag_name, session=session)
-            if tag is None:
-                tag = await TagDAO.add(name=tag_name, session=session)
-            image.tags.append(tag)
+        invalidate_gallery(session, 'likes')
+        query = update(Image).where(Image.id == bindparam('image_id')).values(
+            like_count=Image.like_count + bindparam('delta'))
+        # Executed by the connection, since the ORM treats parameter lists of UPDATE as updates by primary key
+        db_connection = await session.connection()
+        await db_connection.execute(
+            query, [{'image_id': image_id, 'delta': delta} for image_id, delta in deltas.items()])
+
+    # Brings the trending scores to the likes that existed the given number of seconds ago by the database clock:
+    # adds the likes placed since the previous run and subtracts the counted likes removed since then.
+    # Returns the number of processed likes
+    @classmethod
+    @connection
+    async def update_trending_scores(cls, delay_seconds: float, session: AsyncSession) -> int:
+        # The lock prevents concurrent runs from adding the same likes twice
+        state = await session.scalar(select(JobState).where(JobState.name == TRENDING_JOB_NAME).with_for_update())
+        until = await session.scalar(select(database_time_ago(delay_seconds)))
+        if state is not None and state.processed_until >= until:
+            return 0
+        # Likes placed before the bound, including the ones removed after it. A like placed and removed between
+        # the runs was never counted and is skipped
+        placed = select(Like.to_image_id, Like.created_at, literal(1)).where(Like.created_at < until)
+        placed_and_removed = select(RemovedLike.image_id, RemovedLike.liked_at, literal(1)).where(
+            RemovedLike.liked_at < until, RemovedLike.created_at >= until)
+        if state is not None:
+            placed = placed.where(Like.created_at >= state.processed_until)
+            placed_and_removed = placed_and_removed.where(RemovedLike.liked_at >= state.processed_until)
+            # Likes counted by the previous runs and removed before the bound
+            removed = select(RemovedLike.image_id, RemovedLike.liked_at, literal(-1)).where(
+                RemovedLike.liked_at < state.processed_until, RemovedLike.created_at >= state.processed_until,
+                RemovedLike.created_at < until)
+            query = union_all(placed, placed_and_removed, removed)
+        else:
+            query = union_all(placed, placed_and_removed)
+        # A single statement, so a like removed while the job runs is seen either as a like or as a removed like
+        result = await session.execute(query)
+        added_weights, removed_weights = {}, {}
+        likes_count = 0
+        for image_id, liked_at, sign in result:
+            weights = added_weights if sign > 0 else removed_weights
+            weight = get_like_weight(liked_at)
+            weights[image_id] = add_weights(weights[image_id], weight) if image_id in weights else weight
+            likes_count += 1
+        # Removed likes older than the bound are not needed by the next runs
+        await session.execute(delete(RemovedLike).where(RemovedLike.created_at < until))
+        changed_images = added_weights.keys() | removed_weights.keys()
+        if changed_images:
+            result = await session.execute(
+                select(Image.id, Image.trending_score).where(Image.id.in_(changed_images)))
+            scores = []
+            for image_id, score in result:
+                if image_id in added_weights:
+                    score = add_weights(score, added_weights[image_id])
+                if image_id in removed_weights:
+                    score = subtract_weights(score, removed_weights[image_id])
+                scores.append({'image_id': image_id, 'score': score})
+            query = update(Image).where(Image.id == bindparam('image_id')).values(trending_score=bindparam('score'))
+            db_connection = await session.connection()
+            await db_connection.execute(query, scores)
+            invalidate_gallery(session, 'trending')
+        if state is None:
+            session.add(JobState(name=TRENDING_JOB_NAME, processed_until=until))
+        else:
+            state.processed_until = until
+        return likes_count
+
+    @classmethod
+    @connection
+    async def reset_trending_scores(cls, session: AsyncSession) -> None:
+        await session.execute(update(Image).values(trending_score=0))
+        await session.execute(delete(JobState).where(JobState.name == TRENDING_JOB_NAME))
+        invalidate_gallery(session, 'trending')
+
+    @classmethod
+    @connection
+    async def reconcile_like_counts(cls, session: AsyncSession) -> int:
+        actual_count = select(func.count(Like.id)).where(Like.to_image_id == Image.id).scalar_subquery()
+        result = await session.execute(
+            update(Image).where(Image.like_count != actual_count).values(like_count=actual_count))
+        invalidate_gallery(session, 'likes')
+        return result.rowcount
 
 
 class TagDAO(BaseDAO[Tag]):
     model = Tag
 
+    # Returns ids of the tags with the given names by the names, creating the missing tags
+    @classmethod
+    @connection
+    async def add_many_by_names(cls, names: list[str], session: AsyncSession) -> dict[str, uuid.UUID]:
+        # Sorted, so concurrent transactions lock the rows of the same tags in the same order and do not deadlock
+        names = sorted(set(names))
+        if not names:
+            return {}
+        # Tags created by concurrent transactions are skipped instead of failing the whole transaction
+        query = insert_on_conflict(Tag).on_conflict_do_nothing(index_elements=[Tag.name]).returning(Tag.id, Tag.name)
+        result = await session.execute(query, [{'name': name} for name in names])
+        tag_ids = {name: tag_id for tag_id, name in result.all()}
+        existing_names = [name for name in names if name not in tag_ids]
+        if existing_names:
+            result = await session.execute(select(Tag.id, Tag.name).where(Tag.name.in_(existing_names)))
+            tag_ids.update({name: tag_id for tag_id, name in result.all()})
+        return tag_ids
+
 
 class LikeDAO(BaseDAO[Like]):
     model = Like
+
+    # Places the like with a single statement. It is inserted only if the image is public and belongs to another user,
+    # placing it again does nothing. Returns the id of the new like or None if it was not placed
+    @classmethod
+    @connection
+    async def place(cls, from_user_id: uuid.UUID, to_image_id: uuid.UUID, session: AsyncSession,
+                    update_count: bool = True) -> uuid.UUID | None:
+        likeable_image = select(literal(uuid.uuid4(), Like.id.type), literal(from_user_id, Like.from_user_id.type),
+                                Image.id).where(Image.id == to_image_id, Image.is_public.is_(True),
+                                                Image.author_id != from_user_id)
+        query = insert_on_conflict(Like).from_select(
+            [Like.id, Like.from_user_id, Like.to_image_id], likeable_image
+        ).on_conflict_do_nothing(index_elements=[Like.from_user_id, Like.to_image_id]).returning(Like.id)
+        result = await session.execute(query)
+        like_id = result.scalar_one_or_none()
+        if like_id is not None and update_count:
+            await ImageDAO.add_to_like_counts({to_image_id: 1}, session=session)
+        return like_id
+
+    # Deletes the like of the user with a single statement. Returns the id of the liked image or None if
+    # the user has no such like
+    @classmethod
+    @connection
+    async def remove(cls, like_id: uuid.UUID, from_user_id: uuid.UUID, session: AsyncSession,
+                     update_count: bool = True) -> uuid.UUID | None:
+        result = await session.execute(delete(Like).where(Like.id == like_id, Like.from_user_id == from_user_id)
+                                       .returning(Like.to_image_id, Like.created_at))
+        removed_like = result.one_or_none()
+        if removed_like is None:
+            return None
+        image_id, liked_at = removed_like
+        # The weight of the like is subtracted from the trending score by the next update
+        session.add(RemovedLike(image_id=image_id, liked_at=liked_at))
+        if update_count:
+            await ImageDAO.add_to_like_counts({image_id: -1}, session=session)
+        return image_id
+
+
+class GenerationJobDAO(BaseDAO[GenerationJob]):
+    model = GenerationJob
+
+    @classmethod
+    @connection
+    async def find_all_unfinished(cls, session: AsyncSession) -> Sequence[GenerationJob]:
+        query = select(GenerationJob).where(
+            GenerationJob.status.in_([GenerationJobStatus.PENDING, GenerationJobStatus.RUNNING])
+        ).order_by(GenerationJob.created_at)
+        result = await session.execute(query)
+        return result.scalars().all()
+
+    @classmethod
+    @connection
+    async def delete_finished_older_than(cls, hours: float, session: AsyncSession) -> int:
+        result = await session.execute(delete(GenerationJob).where(
+            GenerationJob.status.in_([GenerationJobStatus.DONE, GenerationJobStatus.FAILED]),
+            GenerationJob.updated_at < database_time_ago(hours * 3600)
+        ))
+        return result.rowcount
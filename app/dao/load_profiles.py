@@ -0,0 +1,26 @@
+from typing import Sequence
+
+from sqlalchemy.orm import selectinload
+from sqlalchemy.sql.base import ExecutableOption
+
+from app.database import User, Image
+
+# Relationships are not loaded by default (lazy='raise'), so each query states what it needs with a profile
+LoadProfile = Sequence[ExecutableOption]
+
+# Only the columns of the user, used for authentication
+AUTH_USER: LoadProfile = ()
+
+# Only the columns of the image, used for the cards of the HTML gallery, which show the image, likes and date
+GALLERY_PAGE_CARD: LoadProfile = ()
+
+# Image with the author name, used for image cards of the gallery API. Likes are counted by Image.like_count
+GALLERY_CARD: LoadProfile = (
+    selectinload(Image.author).load_only(User.username),
+)
+
+# Everything that is shown on the image page
+IMAGE_PAGE: LoadProfile = (
+    *GALLERY_CARD,
+    selectinload(Image.tags)
+)
@@ -0,0 +1,25 @@
+from sqlalchemy import Select, ColumnElement, func, literal_column, table, column
+
+from app.config import SETTINGS
+from app.database import Image, SEARCH_LANGUAGE
+
+images_fts = table('images_fts', column('image_id'), column('prompt'), column('rank'))
+
+
+# Every word is quoted, so the user input cannot use the FTS5 query syntax
+def to_fts5_query(term: str) -> str:
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in term.split())
+
+
+# Returns the query filtered by the prompt search and the relevance of the found images (higher is better)
+def search_prompts(query: Select, term: str) -> tuple[Select, ColumnElement]:
+    if SETTINGS.USE_SQLITE:
+        query = query.join(images_fts, images_fts.c.image_id == Image.id).where(
+            images_fts.c.prompt.match(to_fts5_query(term)))
+        # bm25 rank of FTS5 is lower for better matches
+        return query, -images_fts.c.rank
+    # The language must be a literal for the expression to match the index
+    language = literal_column(f"'{SEARCH_LANGUAGE}'")
+    document = func.to_tsvector(language, Image.prompt)
+    search_query = func.websearch_to_tsquery(language, term)
+    return query.where(document.bool_op('@@')(search_query)), func.ts_rank(document, search_query)
@@ -1,10 +1,12 @@
 import uuid
 from collections.abc import Callable
-from datetime import datetime
+from datetime import datetime, timedelta
+from enum import StrEnum
 from typing import Any
 
-from sqlalchemy import func, ForeignKey, JSON, UniqueConstraint
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncAttrs
+from sqlalchemy import func, ForeignKey, JSON, UniqueConstraint, Index, DateTime, text, ColumnElement, cast
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncAttrs, AsyncConnection, AsyncSession
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 from app.config import SETTINGS
@@ -17,60 +19,185 @@ async_session = async_sessionmaker(engine, expire_on_commit=False)
 class Base(AsyncAttrs, DeclarativeBase):
     __abstract__ = True
     type_annotation_map = {
-        list[str]: JSON
+        list[str]: JSON,
+        # SQLite fills server defaults without microseconds, so the bound values must have the same format
+        # to be comparable with them
+        datetime: DateTime().with_variant(
+            sqlite.DATETIME(storage_format='%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d'),
+            'sqlite')
     }
     id: Mapped[uuid.UUID] = mapped_column(insert_default=uuid.uuid4, primary_key=True)
     created_at: Mapped[datetime] = mapped_column(server_default=func.now())
     updated_at: Mapped[datetime] = mapped_column(server_default=func.now(), onupdate=func.now())
 
 
+# Time the given number of seconds ago by the clock of the database, which fills created_at and updated_at,
+# so it can be compared with them even if the clock of the application differs
+def database_time_ago(seconds: float) -> ColumnElement[datetime]:
+    if SETTINGS.USE_SQLITE:
+        # Made in the same format as the server defaults of SQLite
+        return func.datetime('now', f'-{seconds} seconds', type_=DateTime)
+    # Without the time zone, like the server defaults of the columns
+    return cast(func.now() - timedelta(seconds=seconds), DateTime)
+
+
 class User(Base):
     __tablename__ = 'users'
     username: Mapped[str] = mapped_column(unique=True)
     email: Mapped[str] = mapped_column(unique=True)
     hashed_password: Mapped[str]
     generations_left: Mapped[int] = mapped_column(default=SETTINGS.GENERATIONS_PER_DAY)
-    images: Mapped[list['Image']] = relationship(back_populates='author', cascade='all, delete-orphan', lazy='subquery')
-    likes: Mapped[list['Like']] = relationship(back_populates='from_user', cascade='all, delete-orphan',
-                                               lazy='subquery')
+    images: Mapped[list['Image']] = relationship(back_populates='author', cascade='all, delete-orphan', lazy='raise')
+    likes: Mapped[list['Like']] = relationship(back_populates='from_user', cascade='all, delete-orphan', lazy='raise')
 
 
 class ImageTag(Base):
     __tablename__ = 'image_tags'
     image_id: Mapped[uuid.UUID] = mapped_column(ForeignKey('images.id', ondelete='CASCADE'))
     tag_id: Mapped[uuid.UUID] = mapped_column(ForeignKey('tags.id', ondelete='CASCADE'))
-    __table_args__ = (UniqueConstraint('image_id', 'tag_id', name='uq_image_tag'),)
+    # The unique constraint serves lookups by image, the index serves lookups by tag
+    __table_args__ = (UniqueConstraint('image_id', 'tag_id', name='uq_image_tag'),
+                      Index('ix_image_tag_tag_image', 'tag_id', 'image_id'))
 
 
 class Image(Base):
     __tablename__ = 'images'
     url: Mapped[str]
+    # Smaller copies of the image, see app/generation/variants.py. Missing for images created before them
+    thumb_url: Mapped[str | None]
+    thumb_webp_url: Mapped[str | None]
+    webp_url: Mapped[str | None]
     prompt: Mapped[str]
     is_public: Mapped[bool] = mapped_column(default=False)
+    # Denormalized number of likes, maintained by LikeDAO in the same transaction as the likes themselves
+    like_count: Mapped[int] = mapped_column(default=0)
+    # Likes weighted by their recency, see app/utils/trending.py. Updated on a schedule by the trending job
+    trending_score: Mapped[float] = mapped_column(default=0)
     author_id: Mapped[uuid.UUID] = mapped_column(ForeignKey('users.id'))
-    author: Mapped['User'] = relationship(back_populates='images', lazy='subquery')
-    likes: Mapped[list['Like']] = relationship(back_populates='to_image', cascade='all, delete-orphan', lazy='subquery')
-    tags: Mapped[list['Tag']] = relationship(secondary='image_tags', back_populates='images', lazy='subquery')
+    author: Mapped['User'] = relationship(back_populates='images', lazy='raise')
+    likes: Mapped[list['Like']] = relationship(back_populates='to_image', cascade='all, delete-orphan', lazy='raise')
+    tags: Mapped[list['Tag']] = relationship(secondary='image_tags', back_populates='images', lazy='raise')
+    __table_args__ = (Index('ix_image_public_likes', 'is_public', 'like_count', 'created_at'),
+                      Index('ix_image_public_trending', 'is_public', 'trending_score', 'created_at'),
+                      # Serves the galleries of users, which are sorted by date
+                      Index('ix_image_author_created', 'author_id', 'created_at'))
 
 
 class Tag(Base):
     __tablename__ = 'tags'
     name: Mapped[str] = mapped_column(unique=True)
-    images: Mapped[list['Image']] = relationship(secondary='image_tags', back_populates='tags', lazy='subquery')
+    images: Mapped[list['Image']] = relationship(secondary='image_tags', back_populates='tags', lazy='raise')
 
 
 class Like(Base):
     __tablename__ = 'likes'
     from_user_id: Mapped[uuid.UUID] = mapped_column(ForeignKey('users.id'))
     to_image_id: Mapped[uuid.UUID] = mapped_column(ForeignKey('images.id'))
-    from_user: Mapped['User'] = relationship(back_populates='likes', lazy='subquery')
-    to_image: Mapped['Image'] = relationship(back_populates='likes', lazy='subquery')
+    from_user: Mapped['User'] = relationship(back_populates='likes', lazy='raise')
+    to_image: Mapped['Image'] = relationship(back_populates='likes', lazy='raise')
     __table_args__ = (UniqueConstraint('from_user_id', 'to_image_id', name='uq_like'),)
 
 
+# Likes removed since the trending scores were updated, so their weights can be subtracted from the scores.
+# created_at is the time of the removal. Not linked to the image, which can be deleted
+class RemovedLike(Base):
+    __tablename__ = 'removed_likes'
+    image_id: Mapped[uuid.UUID]
+    liked_at: Mapped[datetime]
+
+
+class GenerationJobStatus(StrEnum):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+class GenerationJob(Base):
+    __tablename__ = 'generation_jobs'
+    user_id: Mapped[uuid.UUID] = mapped_column(ForeignKey('users.id', ondelete='CASCADE'))
+    prompt: Mapped[str]
+    use_cache: Mapped[bool] = mapped_column(default=True)
+    status: Mapped[str] = mapped_column(default=GenerationJobStatus.PENDING, index=True)
+    image_id: Mapped[uuid.UUID | None] = mapped_column(ForeignKey('images.id', ondelete='SET NULL'))
+    error: Mapped[str | None]
+
+
+# Progress of scheduled jobs that process new rows incrementally
+class JobState(Base):
+    __tablename__ = 'job_states'
+    name: Mapped[str] = mapped_column(unique=True)
+    processed_until: Mapped[datetime]
+
+
+# Full-text search over image prompts. PostgreSQL uses a GIN index over the prompt tsvector,
+# SQLite uses an FTS5 table that is kept in sync with the images table by triggers
+SEARCH_LANGUAGE = 'english'
+
+POSTGRES_SEARCH_DDL = [
+    f"CREATE INDEX IF NOT EXISTS ix_image_prompt_search ON images USING gin (to_tsvector('{SEARCH_LANGUAGE}', prompt))"
+]
+
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE images_fts USING fts5(image_id UNINDEXED, prompt, tokenize='porter unicode61')",
+    "INSERT INTO images_fts (image_id, prompt) SELECT id, prompt FROM images",
+    "CREATE TRIGGER images_fts_insert AFTER INSERT ON images BEGIN "
+    "INSERT INTO images_fts (image_id, prompt) VALUES (new.id, new.prompt); END",
+    "CREATE TRIGGER images_fts_delete AFTER DELETE ON images BEGIN "
+    "DELETE FROM images_fts WHERE image_id = old.id; END",
+    "CREATE TRIGGER images_fts_update AFTER UPDATE OF prompt ON images BEGIN "
+    "UPDATE images_fts SET prompt = new.prompt WHERE image_id = new.id; END"
+]
+
+
+# Columns and indexes added to tables that existing databases already have. create_all creates only missing tables,
+# so they are added on start. The definitions are accepted by both databases
+ADDED_COLUMNS = [
+    ('images', 'like_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('images', 'trending_score', 'FLOAT NOT NULL DEFAULT 0'),
+    ('images', 'thumb_url', 'VARCHAR'),
+    ('images', 'thumb_webp_url', 'VARCHAR'),
+    ('images', 'webp_url', 'VARCHAR'),
+    ('generation_jobs', 'use_cache', 'BOOLEAN NOT NULL DEFAULT TRUE'),
+]
+
+ADDED_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS ix_image_public_likes ON images (is_public, like_count, created_at)',
+    'CREATE INDEX IF NOT EXISTS ix_image_public_trending ON images (is_public, trending_score, created_at)',
+    'CREATE INDEX IF NOT EXISTS ix_image_tag_tag_image ON image_tags (tag_id, image_id)',
+    'CREATE INDEX IF NOT EXISTS ix_image_author_created ON images (author_id, created_at)',
+]
+
+
+async def upgrade_tables(conn: AsyncConnection) -> None:
+    for table, column, definition in ADDED_COLUMNS:
+        if not SETTINGS.USE_SQLITE:
+            await conn.execute(text(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {definition}'))
+            continue
+        # SQLite has no ADD COLUMN IF NOT EXISTS
+        existing_columns = {row[1] for row in await conn.execute(text(f'PRAGMA table_info({table})'))}
+        if column not in existing_columns:
+            await conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {definition}'))
+    for statement in ADDED_INDEXES:
+        await conn.execute(text(statement))
+
+
 async def create_tables() -> None:
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await upgrade_tables(conn)
+        if not SETTINGS.USE_SQLITE:
+            for statement in POSTGRES_SEARCH_DDL:
+                await conn.execute(text(statement))
+        elif not await conn.scalar(text("SELECT count(*) FROM sqlite_master WHERE name = 'images_fts'")):
+            for statement in SQLITE_SEARCH_DDL:
+                await conn.execute(text(statement))
+
+
+# Registers a function called after the transaction of the session is committed, for example to invalidate cached
+# data only when the change is visible to other sessions. Nothing is called if the transaction is rolled back
+def call_after_commit(session: AsyncSession, callback: Callable[[], Any]) -> None:
+    session.info.setdefault('after_commit', []).append(callback)
 
 
 def connection(method: Callable) -> Callable:
@@ -81,6 +208,8 @@ def connection(method: Callable) -> Callable:
                     kwargs['session'] = session
                 result = await method(*args, **kwargs)
                 await session.commit()
+                for callback in session.info.pop('after_commit', []):
+                    callback()
                 return result
             except Exception as e:
                 await session.rollback()
@@ -7,12 +7,12 @@ from jwt import InvalidTokenError
 from app.dao.dao import UserDAO, ImageDAO, LikeDAO
 from app.database import User, Image, Like
 from app.exceptions import UserNotLoggedInException, ImageNotFoundException, UserNotFoundException, \
-    NoAccessToImageException, LikeNotFoundException
-from app.schemas import RequestPlaceLike
+    NoAccessToImageException
+from app.schemas import UserSnapshot
 from app.utils.auth import get_access_token, get_refresh_token, get_user_by_token
 
 
-async def get_current_user_by_refresh_token(request: Request) -> User:
+async def get_current_user_by_refresh_token(request: Request) -> UserSnapshot:
     try:
         refresh_token = get_refresh_token(request)
         user = await get_user_by_token(refresh_token, 'refresh')
@@ -22,10 +22,10 @@ async def get_current_user_by_refresh_token(request: Request) -> User:
 
 
 # Used only for token refreshes
-CurrentUserRefresh = Annotated[User, Depends(get_current_user_by_refresh_token)]
+CurrentUserRefresh = Annotated[UserSnapshot, Depends(get_current_user_by_refresh_token)]
 
 
-async def get_current_user(request: Request) -> User:
+async def get_current_user(request: Request) -> UserSnapshot:
     try:
         access_token = get_access_token(request)
         user = await get_user_by_token(access_token, 'access')
@@ -35,10 +35,10 @@ async def get_current_user(request: Request) -> User:
 
 
 # Used for endpoints that require authorization
-CurrentUser = Annotated[User, Depends(get_current_user)]
+CurrentUser = Annotated[UserSnapshot, Depends(get_current_user)]
 
 
-async def get_current_user_or_none(request: Request) -> User | None:
+async def get_current_user_or_none(request: Request) -> UserSnapshot | None:
     try:
         return await get_current_user(request)
     except HTTPException:
@@ -46,13 +46,10 @@ async def get_current_user_or_none(request: Request) -> User | None:
 
 
 # Used for endpoints with optional authorization
-OptionalCurrentUser = Annotated[User | None, Depends(get_current_user_or_none)]
+OptionalCurrentUser = Annotated[UserSnapshot | None, Depends(get_current_user_or_none)]
 
 
-async def get_image_by_id(current_user: OptionalCurrentUser, image_id: uuid.UUID | None = None,
-                          like_data: RequestPlaceLike | None = None) -> Image:
-    image_id = image_id or like_data.to_image_id
-    image = await ImageDAO.find_one_or_none_by_id(image_id)
+def check_image_access(image: Image | None, current_user: UserSnapshot | None) -> Image:
     if not image:
         raise ImageNotFoundException()
     if not image.is_public and (current_user is None or current_user.id != image.author_id):
@@ -60,6 +57,12 @@ async def get_image_by_id(current_user: OptionalCurrentUser, image_id: uuid.UUID
     return image
 
 
+async def get_image_by_id(current_user: OptionalCurrentUser, image_id: uuid.UUID) -> Image:
+    image = await ImageDAO.find_one_or_none_by_id(image_id)
+    return check_image_access(image, current_user)
+
+
+# Image without relationships, used for actions on the image
 ImageById = Annotated[Image, Depends(get_image_by_id)]
 
 
@@ -81,13 +84,3 @@ async def get_like_by_image(image_id: uuid.UUID, current_user: OptionalCurrentUs
 
 
 LikeByImage = Annotated[Like | None, Depends(get_like_by_image)]
-
-
-async def get_like_by_id(like_id: uuid.UUID, current_user: CurrentUser) -> Like:
-    like = await LikeDAO.find_one_or_none_by_id(like_id)
-    if not like:
-        raise LikeNotFoundException()
-    return like
-
-
-LikeById = Annotated[Like, Depends(get_like_by_id)]
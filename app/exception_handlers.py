@@ -1,28 +1,42 @@
 import inspect
 import logging
+from collections.abc import Callable
+from typing import Annotated, get_args, get_origin
 
-from fastapi import FastAPI, Request, status
+from fastapi import FastAPI, Request, status, params
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
+from pydantic import BaseModel
 
 from app.exceptions import UserNotLoggedInException
 
 templates = Jinja2Templates(directory='templates')
 
 
+# Pydantic model of the parameters of the handler from the given location (body or query) whose fields have
+# the custom error messages. Dependencies such as the current user are skipped, even though they are models too
+def get_model(route_handler: Callable, location: str) -> type[BaseModel] | None:
+    for param in inspect.signature(route_handler).parameters.values():
+        annotation, metadata = param.annotation, ()
+        if get_origin(annotation) is Annotated:
+            annotation, *metadata = get_args(annotation)
+        if any(isinstance(item, params.Depends) for item in metadata):
+            continue
+        if not (inspect.isclass(annotation) and issubclass(annotation, BaseModel)):
+            continue
+        is_query = any(isinstance(item, params.Query) for item in metadata)
+        if is_query == (location == 'query'):
+            return annotation
+    return None
+
+
 def init_exception_handlers(app: FastAPI) -> None:
     @app.exception_handler(RequestValidationError)
     async def validation_exception_handler(request: Request, exc: RequestValidationError):
         error = exc.errors()[0]
         logging.warning(f'Validation error: {error}')
-        route_handler = request.scope['route'].endpoint
-        sig = inspect.signature(route_handler)
-        model = None
-        for param in sig.parameters.values():
-            if hasattr(param.annotation, 'model_fields'):  # Check if it's a Pydantic model
-                model = param.annotation
-                break
+        model = get_model(request.scope['route'].endpoint, error['loc'][0])
         field_name = error['loc'][-1]
         field_info = model.model_fields.get(field_name) if model else None
         custom_message = field_info.description if field_info and field_info.description else error['msg']
@@ -46,11 +46,31 @@ class CredentialsException(CustomHTTPException):
     detail = 'Incorrect username or password'
 
 
+class TooManyLoginAttemptsException(CustomHTTPException):
+    status_code = status.HTTP_429_TOO_MANY_REQUESTS
+    detail = 'Too many login attempts. Try again later'
+
+
 class GeneratingImageException(CustomHTTPException):
     status_code = status.HTTP_503_SERVICE_UNAVAILABLE
     detail = 'An error occurred while generating the image. Please try again'
 
 
+class GenerationUnavailableException(CustomHTTPException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    detail = 'Image generation is temporarily unavailable. Please try again later'
+
+
+class TooManyGenerationsInProgressException(CustomHTTPException):
+    status_code = status.HTTP_429_TOO_MANY_REQUESTS
+    detail = 'Too many of your images are being generated. Please wait until they are finished'
+
+
+class GenerationQueueFullException(CustomHTTPException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    detail = 'Too many images are being generated right now. Please try again later'
+
+
 class NoGenerationLeftException(CustomHTTPException):
     status_code = status.HTTP_400_BAD_REQUEST
     detail = 'Your generations for today are over. Try again tomorrow'
@@ -79,3 +99,8 @@ class NoAccessToLikeException(CustomHTTPException):
 class LikeNotFoundException(CustomHTTPException):
     status_code = status.HTTP_404_NOT_FOUND
     detail = 'This like does not exist'
+
+
+class GenerationJobNotFoundException(CustomHTTPException):
+    status_code = status.HTTP_404_NOT_FOUND
+    detail = 'This generation does not exist'
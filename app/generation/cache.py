@@ -0,0 +1,63 @@
+import asyncio
+import hashlib
+from collections.abc import Callable, Awaitable
+from dataclasses import dataclass, field
+
+from app.config import SETTINGS
+from app.utils.cache import TTLCache
+
+
+# Result of the external APIs for a prompt: the uploaded image and its tags
+@dataclass
+class GeneratedImage:
+    url: str
+    tag_names: list[str]
+    # URLs of the variants by the columns of Image
+    variant_urls: dict[str, str] = field(default_factory=dict)
+
+
+# Images generated recently by the prompt and the parameters of the model, so repeated prompts (retries, double clicks)
+# do not make paid requests. Identical generations that run at the same time are made only once
+class GenerationCache:
+    cache: TTLCache[str, GeneratedImage] = TTLCache(SETTINGS.GENERATION.CACHE_MAX_SIZE,
+                                                    SETTINGS.GENERATION.CACHE_TTL_SECONDS)
+    in_flight: dict[str, asyncio.Task[GeneratedImage]] = {}
+    coalesced: int = 0
+
+    @classmethod
+    def make_key(cls, prompt: str) -> str:
+        normalized_prompt = ' '.join(prompt.lower().split())
+        key = (f'{normalized_prompt}|{SETTINGS.CLOUDFLARE.IMAGES_MODEL_NAME}|'
+               f'{SETTINGS.CLOUDFLARE.IMAGE_WIDTH}x{SETTINGS.CLOUDFLARE.IMAGE_HEIGHT}')
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @classmethod
+    async def get_or_generate(cls, prompt: str,
+                              generate: Callable[[], Awaitable[GeneratedImage]]) -> GeneratedImage:
+        key = cls.make_key(prompt)
+        generated = cls.cache.get(key)
+        if generated is not None:
+            return generated
+        task = cls.in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(cls.generate_and_store(key, generate))
+            cls.in_flight[key] = task
+            task.add_done_callback(lambda _: cls.in_flight.pop(key, None))
+        else:
+            cls.coalesced += 1
+        # The generation is shared, so it is not cancelled together with one of the waiting jobs
+        return await asyncio.shield(task)
+
+    @classmethod
+    async def generate_and_store(cls, key: str, generate: Callable[[], Awaitable[GeneratedImage]]) -> GeneratedImage:
+        generated = await generate()
+        cls.cache.set(key, generated)
+        return generated
+
+    @classmethod
+    def get_metrics(cls) -> dict[str, int | float]:
+        return {
+            **cls.cache.get_metrics(),
+            'in_flight': len(cls.in_flight),
+            'coalesced': cls.coalesced
+        }
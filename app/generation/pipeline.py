@@ -0,0 +1,45 @@
+import logging
+import uuid
+
+from app.config import SETTINGS
+from app.dao.dao import ImageDAO
+from app.generation.cache import GeneratedImage, GenerationCache
+from app.generation.stages import StageGraph, Stage
+from app.generation.variants import create_variants
+from app.storage.backends import get_storage
+from app.utils.api_calls.cloudflare import generate_image_from_prompt, generate_tags_for_image
+
+
+# Generates the image with its tags and saves it to the storage together with its smaller variants.
+# Tagging, uploading and creating variants depend only on the generated image and run concurrently, all of them use
+# the same decoded image. The image is saved without tags or variants if they fail
+async def create_generated_image(prompt: str) -> GeneratedImage:
+    graph = StageGraph([
+        Stage('generate', lambda: generate_image_from_prompt(prompt)),
+        Stage('tags', lambda generate: generate_tags_for_image(generate, prompt), depends_on=('generate',),
+              timeout=SETTINGS.GENERATION.TAGS_TIMEOUT_SECONDS, optional=True, fallback=[]),
+        Stage('upload', lambda generate: get_storage().save(generate.data, generate.content_type),
+              depends_on=('generate',)),
+        Stage('variants', lambda generate: create_variants(generate.data), depends_on=('generate',), optional=True,
+              fallback={})
+    ])
+    results = await graph.run()
+    return GeneratedImage(url=results['upload'], tag_names=results['tags'], variant_urls=results['variants'])
+
+
+# Generates the image or reuses the one recently generated by the same prompt
+async def get_generated_image(prompt: str, use_cache: bool = True) -> GeneratedImage:
+    if use_cache:
+        return await GenerationCache.get_or_generate(prompt, lambda: create_generated_image(prompt))
+    return await create_generated_image(prompt)
+
+
+# Stores the images generated for the prompts of the users in one transaction. Each image is given by the id
+# of its author, its prompt and the generated image. Returns the ids of the new images in the same order
+async def store_generated_images(images: list[tuple[uuid.UUID, str, GeneratedImage]]) -> list[uuid.UUID]:
+    image_ids = await ImageDAO.add_many_generated([
+        {'author_id': user_id, 'url': generated.url, 'prompt': prompt, 'tag_names': generated.tag_names,
+         **generated.variant_urls}
+        for user_id, prompt, generated in images])
+    logging.info(f'Created {len(image_ids)} images')
+    return image_ids
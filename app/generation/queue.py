@@ -0,0 +1,334 @@
+import asyncio
+import logging
+import math
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+from collections.abc import Sequence
+
+from app.config import SETTINGS
+from app.dao.dao import GenerationJobDAO, UserDAO
+from app.database import GenerationJob, GenerationJobStatus
+from app.exceptions import GeneratingImageException, TooManyGenerationsInProgressException, \
+    GenerationQueueFullException
+from app.generation.cache import GeneratedImage
+from app.generation.pipeline import get_generated_image, store_generated_images
+from app.utils.rate_limiter import TokenBucket
+
+# Number of the last started jobs used for the metrics of the wait time
+WAIT_TIMES_WINDOW = 1000
+
+
+# Storage of generation jobs
+class JobBackend(ABC):
+    @abstractmethod
+    async def add(self, user_id: uuid.UUID, prompt: str, use_cache: bool = True) -> GenerationJob:
+        pass
+
+    @abstractmethod
+    async def add_many(self, user_id: uuid.UUID, prompts: list[str], use_cache: bool = True) -> list[GenerationJob]:
+        pass
+
+    @abstractmethod
+    async def get(self, job_id: uuid.UUID) -> GenerationJob | None:
+        pass
+
+    @abstractmethod
+    async def update(self, job_id: uuid.UUID, **values) -> None:
+        pass
+
+    # Jobs that were not finished before the restart
+    @abstractmethod
+    async def get_unfinished(self) -> Sequence[GenerationJob]:
+        pass
+
+
+# Jobs are stored in the database and survive restarts
+class DatabaseJobBackend(JobBackend):
+    async def add(self, user_id: uuid.UUID, prompt: str, use_cache: bool = True) -> GenerationJob:
+        return await GenerationJobDAO.add(user_id=user_id, prompt=prompt, use_cache=use_cache,
+                                          status=GenerationJobStatus.PENDING)
+
+    async def add_many(self, user_id: uuid.UUID, prompts: list[str], use_cache: bool = True) -> list[GenerationJob]:
+        return await GenerationJobDAO.add_many([
+            {'user_id': user_id, 'prompt': prompt, 'use_cache': use_cache, 'status': GenerationJobStatus.PENDING}
+            for prompt in prompts])
+
+    async def get(self, job_id: uuid.UUID) -> GenerationJob | None:
+        return await GenerationJobDAO.find_one_or_none_by_id(job_id)
+
+    async def update(self, job_id: uuid.UUID, **values) -> None:
+        await GenerationJobDAO.update_one_by_id(job_id, **values)
+
+    async def get_unfinished(self) -> Sequence[GenerationJob]:
+        return await GenerationJobDAO.find_all_unfinished()
+
+
+# Jobs are stored in the process memory, used for testing
+class MemoryJobBackend(JobBackend):
+    def __init__(self):
+        self.jobs: dict[uuid.UUID, GenerationJob] = {}
+
+    async def add(self, user_id: uuid.UUID, prompt: str, use_cache: bool = True) -> GenerationJob:
+        job = GenerationJob(id=uuid.uuid4(), user_id=user_id, prompt=prompt, use_cache=use_cache,
+                            status=GenerationJobStatus.PENDING)
+        self.jobs[job.id] = job
+        return job
+
+    async def add_many(self, user_id: uuid.UUID, prompts: list[str], use_cache: bool = True) -> list[GenerationJob]:
+        return [await self.add(user_id, prompt, use_cache) for prompt in prompts]
+
+    async def get(self, job_id: uuid.UUID) -> GenerationJob | None:
+        return self.jobs.get(job_id)
+
+    async def update(self, job_id: uuid.UUID, **values) -> None:
+        job = self.jobs[job_id]
+        for key, value in values.items():
+            setattr(job, key, value)
+
+    async def get_unfinished(self) -> Sequence[GenerationJob]:
+        return []
+
+
+# Queue of jobs in which users take turns: the next job is taken from the user after the one whose job was taken last,
+# so a user with many jobs does not delay the jobs of the others
+class FairQueue:
+    def __init__(self):
+        # Users with queued jobs, in the order of their turns
+        self.jobs: dict[uuid.UUID, deque[uuid.UUID]] = {}
+        self.available = asyncio.Semaphore(0)
+        self.size = 0
+
+    def put(self, user_id: uuid.UUID, job_id: uuid.UUID) -> None:
+        self.jobs.setdefault(user_id, deque()).append(job_id)
+        self.size += 1
+        self.available.release()
+
+    # Returns the id of the user and the id of the job
+    async def get(self) -> tuple[uuid.UUID, uuid.UUID]:
+        await self.available.acquire()
+        user_id = next(iter(self.jobs))
+        user_jobs = self.jobs.pop(user_id)
+        job_id = user_jobs.popleft()
+        if user_jobs:
+            self.jobs[user_id] = user_jobs
+        self.size -= 1
+        return user_id, job_id
+
+    def qsize(self) -> int:
+        return self.size
+
+
+# Image generations are run in the background by a fixed number of workers, so the number of concurrent requests
+# to the external APIs is limited and the client does not wait for the generation to finish.
+# A generation of the user is reserved before the job is created and refunded if the job fails.
+# Jobs are admitted before the generation is reserved: a user can have a limited number of unfinished jobs, and no jobs
+# are accepted while the queue is full, so the wait stays predictable and excess requests are rejected at once.
+# Generations are started no faster than the rate allowed by the API. Images finished while other images are being
+# stored wait and are stored together, so concurrent jobs share the inserts and the commit
+class GenerationQueue:
+    backend: JobBackend | None = None
+    queue: FairQueue | None = None
+    workers: list[asyncio.Task] = []
+    rate_limiter: TokenBucket | None = None
+    # Numbers of admitted and not yet finished jobs by users
+    unfinished_jobs: dict[uuid.UUID, int] = {}
+    enqueued_at: dict[uuid.UUID, float] = {}
+    running_jobs: int = 0
+    wait_times: deque[float] = deque(maxlen=WAIT_TIMES_WINDOW)
+    # Exponential moving average of the time of a generation
+    average_job_seconds: float | None = None
+    rejected_user_limit: int = 0
+    rejected_queue_full: int = 0
+    # Generated images waiting to be stored with the futures of their ids
+    pending_images: list[tuple[uuid.UUID, str, GeneratedImage, asyncio.Future]] = []
+    storing_images: asyncio.Lock | None = None
+    stored_images: int = 0
+    image_store_batches: int = 0
+
+    @classmethod
+    async def start(cls, backend: JobBackend | None = None) -> None:
+        if backend is None:
+            backend = DatabaseJobBackend() if SETTINGS.GENERATION.JOB_BACKEND == 'database' else MemoryJobBackend()
+        cls.backend = backend
+        cls.queue = FairQueue()
+        cls.unfinished_jobs = {}
+        cls.enqueued_at = {}
+        cls.running_jobs = 0
+        cls.pending_images = []
+        cls.storing_images = asyncio.Lock()
+        if SETTINGS.GENERATION.RATE_PER_SECOND > 0:
+            cls.rate_limiter = TokenBucket(SETTINGS.GENERATION.RATE_PER_SECOND, SETTINGS.GENERATION.RATE_BURST)
+        for job in await backend.get_unfinished():
+            cls.unfinished_jobs[job.user_id] = cls.unfinished_jobs.get(job.user_id, 0) + 1
+            cls.put(job.user_id, job.id)
+        cls.workers = [asyncio.create_task(cls.work()) for _ in range(SETTINGS.GENERATION.WORKERS)]
+        logging.info(f'Started {len(cls.workers)} generation workers, {cls.queue.qsize()} jobs resumed')
+
+    @classmethod
+    async def stop(cls) -> None:
+        for worker in cls.workers:
+            worker.cancel()
+        await asyncio.gather(*cls.workers, return_exceptions=True)
+        cls.workers = []
+
+    @classmethod
+    def get_backend(cls) -> JobBackend:
+        if cls.backend is None:
+            raise RuntimeError('Generation queue is not started')
+        return cls.backend
+
+    # Admits the jobs of the user or raises an exception with the time after which they can be admitted.
+    # The jobs count towards the limits until they are finished, or until release is called if they are not enqueued
+    @classmethod
+    def admit(cls, user_id: uuid.UUID, count: int = 1) -> None:
+        unfinished_jobs = cls.unfinished_jobs.get(user_id, 0)
+        if unfinished_jobs + count > SETTINGS.GENERATION.MAX_JOBS_PER_USER:
+            cls.rejected_user_limit += 1
+            raise TooManyGenerationsInProgressException(headers={'Retry-After': str(cls.get_retry_after(1))})
+        queued_jobs = cls.get_queued_jobs()
+        if queued_jobs + count > SETTINGS.GENERATION.MAX_QUEUED_JOBS:
+            cls.rejected_queue_full += 1
+            raise GenerationQueueFullException(headers={'Retry-After': str(cls.get_retry_after(queued_jobs))})
+        cls.unfinished_jobs[user_id] = unfinished_jobs + count
+
+    @classmethod
+    def release(cls, user_id: uuid.UUID, count: int = 1) -> None:
+        unfinished_jobs = cls.unfinished_jobs.get(user_id, 0) - count
+        if unfinished_jobs > 0:
+            cls.unfinished_jobs[user_id] = unfinished_jobs
+        else:
+            cls.unfinished_jobs.pop(user_id, None)
+
+    # Estimated number of seconds until the given number of queued jobs are started
+    @classmethod
+    def get_retry_after(cls, jobs: int) -> int:
+        job_seconds = cls.average_job_seconds or 1
+        seconds = jobs * job_seconds / max(len(cls.workers), 1)
+        if cls.rate_limiter is not None:
+            seconds = max(seconds, jobs / cls.rate_limiter.rate)
+        return max(math.ceil(seconds), 1)
+
+    # Admitted jobs that are not started yet, including the ones that are being created or wait for the rate limiter
+    @classmethod
+    def get_queued_jobs(cls) -> int:
+        return sum(cls.unfinished_jobs.values()) - cls.running_jobs
+
+    @classmethod
+    def put(cls, user_id: uuid.UUID, job_id: uuid.UUID) -> None:
+        cls.enqueued_at[job_id] = time.monotonic()
+        cls.queue.put(user_id, job_id)
+
+    # The job must be admitted before
+    @classmethod
+    async def enqueue(cls, user_id: uuid.UUID, prompt: str, use_cache: bool = True) -> GenerationJob:
+        job = await cls.get_backend().add(user_id, prompt, use_cache)
+        cls.put(user_id, job.id)
+        logging.info(f'Enqueued generation job with id {job.id}')
+        return job
+
+    # Creates the jobs of a batch together, a job for every prompt. The jobs must be admitted before
+    @classmethod
+    async def enqueue_many(cls, user_id: uuid.UUID, prompts: list[str], use_cache: bool = True) -> list[GenerationJob]:
+        jobs = await cls.get_backend().add_many(user_id, prompts, use_cache)
+        for job in jobs:
+            cls.put(user_id, job.id)
+        logging.info(f'Enqueued {len(jobs)} generation jobs of a batch')
+        return jobs
+
+    @classmethod
+    async def get_job(cls, job_id: uuid.UUID) -> GenerationJob | None:
+        return await cls.get_backend().get(job_id)
+
+    @classmethod
+    def get_metrics(cls) -> dict[str, int | float | None]:
+        wait_times = sorted(cls.wait_times)
+        return {
+            'workers': len(cls.workers),
+            'queued_jobs': cls.get_queued_jobs(),
+            'queued_users': len(cls.queue.jobs) if cls.queue is not None else 0,
+            'unfinished_jobs': sum(cls.unfinished_jobs.values()),
+            'rejected_user_limit': cls.rejected_user_limit,
+            'rejected_queue_full': cls.rejected_queue_full,
+            'rate_limiter_tokens': cls.rate_limiter.get_tokens() if cls.rate_limiter is not None else None,
+            'wait_seconds_p50': wait_times[len(wait_times) // 2] if wait_times else None,
+            'wait_seconds_p95': wait_times[int(len(wait_times) * 0.95)] if wait_times else None,
+            'wait_seconds_max': wait_times[-1] if wait_times else None,
+            'average_job_seconds': cls.average_job_seconds,
+            'stored_images': cls.stored_images,
+            'image_store_batches': cls.image_store_batches
+        }
+
+    @classmethod
+    async def work(cls) -> None:
+        while True:
+            user_id, job_id = await cls.queue.get()
+            try:
+                if cls.rate_limiter is not None:
+                    await cls.rate_limiter.acquire()
+                cls.wait_times.append(time.monotonic() - cls.enqueued_at.pop(job_id))
+                start = time.monotonic()
+                cls.running_jobs += 1
+                try:
+                    await cls.run_job(job_id)
+                finally:
+                    cls.running_jobs -= 1
+                job_seconds = time.monotonic() - start
+                if cls.average_job_seconds is None:
+                    cls.average_job_seconds = job_seconds
+                else:
+                    cls.average_job_seconds = 0.9 * cls.average_job_seconds + 0.1 * job_seconds
+            except Exception as e:
+                logging.error(f'Error while running generation job with id {job_id}: {e}', exc_info=True)
+            finally:
+                cls.release(user_id)
+
+    # The image waits while the images of other jobs are stored, then the images that arrived in the meantime
+    # are stored together by one of the waiting jobs. Returns the id of the new image
+    @classmethod
+    async def store_image(cls, user_id: uuid.UUID, prompt: str, generated: GeneratedImage) -> uuid.UUID:
+        future = asyncio.get_running_loop().create_future()
+        cls.pending_images.append((user_id, prompt, generated, future))
+        async with cls.storing_images:
+            if not future.done():
+                pending_images, cls.pending_images = cls.pending_images, []
+                try:
+                    image_ids = await store_generated_images([image[:3] for image in pending_images])
+                except Exception as e:
+                    for *_, pending_future in pending_images:
+                        pending_future.set_exception(e)
+                else:
+                    for (*_, pending_future), image_id in zip(pending_images, image_ids):
+                        pending_future.set_result(image_id)
+                    cls.stored_images += len(image_ids)
+                    cls.image_store_batches += 1
+        return await future
+
+    @classmethod
+    async def run_job(cls, job_id: uuid.UUID) -> None:
+        backend = cls.get_backend()
+        job = await backend.get(job_id)
+        if job is None:
+            return
+        await backend.update(job_id, status=GenerationJobStatus.RUNNING)
+        try:
+            generated = await get_generated_image(job.prompt, job.use_cache)
+            image_id = await cls.store_image(job.user_id, job.prompt, generated)
+        except Exception as e:
+            logging.error(f'Error while generating image for job with id {job_id}: {e}', exc_info=True)
+            # The generation is refunded even if the state of the job cannot be saved
+            try:
+                await backend.update(job_id, status=GenerationJobStatus.FAILED, error=GeneratingImageException.detail)
+            except Exception as update_error:
+                logging.error(f'Error while saving the failure of generation job with id {job_id}: {update_error}',
+                              exc_info=True)
+            finally:
+                await UserDAO.refund_generations_by_id(job.user_id)
+            return
+        try:
+            await backend.update(job_id, status=GenerationJobStatus.DONE, image_id=image_id)
+        except Exception as e:
+            logging.error(f'Error while saving the result of generation job with id {job_id}: {e}', exc_info=True)
+            return
+        logging.info(f'Finished generation job with id {job_id}')
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import time
+from collections.abc import Callable, Awaitable
+from dataclasses import dataclass, field
+from typing import Any
+
+
+# A step of a pipeline. The function receives the results of the stages it depends on as keyword arguments.
+# If an optional stage fails or times out, its fallback is used as the result
+@dataclass
+class Stage:
+    name: str
+    function: Callable[..., Awaitable[Any]]
+    depends_on: tuple[str, ...] = ()
+    timeout: float | None = None
+    optional: bool = False
+    fallback: Any = None
+
+
+@dataclass
+class StageGraph:
+    stages: list[Stage] = field(default_factory=list)
+
+    # Stages run as soon as the stages they depend on are finished, so independent stages run concurrently
+    async def run(self) -> dict[str, Any]:
+        tasks: dict[str, asyncio.Task] = {}
+
+        async def run_stage(stage: Stage) -> Any:
+            inputs = {name: await tasks[name] for name in stage.depends_on}
+            start = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(stage.function(**inputs), stage.timeout)
+            except Exception as e:
+                if not stage.optional:
+                    raise
+                logging.warning(f'Optional stage {stage.name} failed, using fallback: {e!r}')
+                result = stage.fallback
+            logging.info(f'Stage {stage.name} took {time.perf_counter() - start:.3f}s')
+            return result
+
+        start = time.perf_counter()
+        for stage in self.stages:
+            missing = [name for name in stage.depends_on if name not in tasks]
+            if missing:
+                raise ValueError(f'Stage {stage.name} depends on stages {missing} that are not defined before it')
+            tasks[stage.name] = asyncio.create_task(run_stage(stage))
+        try:
+            results = await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        logging.info(f'All stages took {time.perf_counter() - start:.3f}s')
+        return dict(zip(tasks, results))
@@ -0,0 +1,52 @@
+import asyncio
+import io
+from dataclasses import dataclass
+
+from PIL import Image as PillowImage
+
+from app.config import SETTINGS
+from app.storage.backends import get_storage
+
+
+# Smaller copy of the original image. Its URL is stored in the column of Image with the same name
+@dataclass
+class ImageVariant:
+    column: str
+    content_type: str
+    # None keeps the size of the original
+    width: int | None
+
+
+VARIANTS = (
+    ImageVariant('thumb_url', 'image/jpeg', SETTINGS.GENERATION.THUMBNAIL_WIDTH),
+    ImageVariant('thumb_webp_url', 'image/webp', SETTINGS.GENERATION.THUMBNAIL_WIDTH),
+    ImageVariant('webp_url', 'image/webp', None)
+)
+
+PILLOW_FORMATS = {'image/jpeg': 'JPEG', 'image/webp': 'WEBP'}
+
+
+# Encodes the variants of the image. Takes time of the processor, so it must not be run in the event loop
+def render_variants(data: bytes) -> dict[str, tuple[bytes, str]]:
+    original = PillowImage.open(io.BytesIO(data)).convert('RGB')
+    variants = {}
+    for variant in VARIANTS:
+        image = original
+        if variant.width is not None and original.width > variant.width:
+            height = round(original.height * variant.width / original.width)
+            image = original.resize((variant.width, height), PillowImage.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, PILLOW_FORMATS[variant.content_type], quality=SETTINGS.GENERATION.VARIANTS_QUALITY,
+                   optimize=True)
+        variants[variant.column] = (buffer.getvalue(), variant.content_type)
+    return variants
+
+
+# Saves the rendered variants to the storage and returns their URLs by the columns of Image
+async def save_variants(variants: dict[str, tuple[bytes, str]]) -> dict[str, str]:
+    urls = await asyncio.gather(*(get_storage().save(data, content_type) for data, content_type in variants.values()))
+    return dict(zip(variants.keys(), urls))
+
+
+async def create_variants(data: bytes) -> dict[str, str]:
+    return await save_variants(await asyncio.to_thread(render_variants, data))
@@ -0,0 +1,46 @@
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from app.dao.dao import ImageDAO
+from app.database import Image
+from app.generation.variants import render_variants, save_variants
+from app.storage.backends import get_storage
+from app.utils.api_calls.http_client import HttpClient
+
+BATCH_SIZE = 50
+
+
+async def create_variants_for_image(image: Image, pool: ProcessPoolExecutor) -> bool:
+    try:
+        data = await get_storage().load(image.url)
+        variants = await asyncio.get_running_loop().run_in_executor(pool, render_variants, data)
+        variant_urls = await save_variants(variants)
+        await ImageDAO.update_one_by_id(image.id, **variant_urls)
+        return True
+    except Exception as e:
+        logging.error(f'Failed to create variants for image with id {image.id}: {e}')
+        return False
+
+
+# Creates variants of the images that do not have them. Images of a batch are encoded in parallel by a pool of processes
+async def job_create_image_variants() -> None:
+    await HttpClient.start()
+    created, failed = 0, 0
+    try:
+        with ProcessPoolExecutor() as pool:
+            last_id = None
+            while images := await ImageDAO.find_all_without_variants(after_id=last_id, limit=BATCH_SIZE):
+                results = await asyncio.gather(*(create_variants_for_image(image, pool) for image in images))
+                created += sum(results)
+                failed += len(results) - sum(results)
+                last_id = images[-1].id
+                logging.info(f'Created variants for {created} images, {failed} failed')
+    finally:
+        await HttpClient.close()
+
+
+# python -m app.jobs.create_image_variants
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    asyncio.run(job_create_image_variants())
@@ -0,0 +1,9 @@
+import logging
+
+from app.config import SETTINGS
+from app.dao.dao import GenerationJobDAO
+
+
+async def job_delete_old_generation_jobs() -> None:
+    deleted = await GenerationJobDAO.delete_finished_older_than(SETTINGS.GENERATION.JOBS_RETENTION_HOURS)
+    logging.info(f'Deleted {deleted} old generation jobs')
@@ -0,0 +1,15 @@
+import asyncio
+import logging
+
+from app.dao.dao import ImageDAO
+
+
+async def job_reconcile_like_counts() -> None:
+    updated = await ImageDAO.reconcile_like_counts()
+    logging.info(f'Like counts reconciled, fixed {updated} images')
+
+
+# Can be run once to fill like counts of existing images: python -m app.jobs.reconcile_like_counts
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    asyncio.run(job_reconcile_like_counts())
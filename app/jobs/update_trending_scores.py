@@ -0,0 +1,24 @@
+import asyncio
+import logging
+import sys
+
+from app.dao.dao import ImageDAO
+
+# Likes placed in the last seconds may belong to transactions that are not committed yet
+UNCOMMITTED_LIKES_SECONDS = 30
+
+
+async def job_update_trending_scores() -> None:
+    processed = await ImageDAO.update_trending_scores(UNCOMMITTED_LIKES_SECONDS)
+    logging.info(f'Trending scores updated with {processed} new likes')
+
+
+async def rebuild_trending_scores() -> None:
+    await ImageDAO.reset_trending_scores()
+    await job_update_trending_scores()
+
+
+# Can be run to calculate the scores again from all likes: python -m app.jobs.update_trending_scores --rebuild
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    asyncio.run(rebuild_trending_scores() if '--rebuild' in sys.argv else job_update_trending_scores())
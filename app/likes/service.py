@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import uuid
+
+from app.config import SETTINGS
+from app.dao.dao import LikeDAO, ImageDAO
+from app.dependencies import check_image_access
+from app.exceptions import PlacingLikeException, LikeAlreadyPlacedException, LikeNotFoundException, \
+    NoAccessToLikeException
+from app.schemas import UserSnapshot
+
+
+# Places and deletes likes with one statement each. The checks are made by the statements themselves,
+# the reason of a failure is looked up only when nothing was changed.
+# In write-behind mode the like counters are not updated together with the likes, which makes all likes of a popular
+# image wait for the lock of its row. Changes of the counters are accumulated per image and written in batches
+class LikeService:
+    deltas: dict[uuid.UUID, int] = {}
+    flusher: asyncio.Task | None = None
+    flushes: int = 0
+    flush_errors: int = 0
+
+    @classmethod
+    def start(cls) -> None:
+        if SETTINGS.LIKES.WRITE_BEHIND:
+            cls.flusher = asyncio.create_task(cls.flush_periodically())
+            logging.info('Started write-behind of like counters')
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls.flusher is None:
+            return
+        cls.flusher.cancel()
+        await asyncio.gather(cls.flusher, return_exceptions=True)
+        cls.flusher = None
+        await cls.flush()
+
+    @classmethod
+    def is_write_behind(cls) -> bool:
+        return cls.flusher is not None
+
+    @classmethod
+    async def place(cls, current_user: UserSnapshot, image_id: uuid.UUID) -> uuid.UUID:
+        write_behind = cls.is_write_behind()
+        like_id = await LikeDAO.place(current_user.id, image_id, update_count=not write_behind)
+        if like_id is None:
+            image = await ImageDAO.find_one_or_none_by_id(image_id)
+            check_image_access(image, current_user)
+            if image.author_id == current_user.id:
+                raise PlacingLikeException()
+            raise LikeAlreadyPlacedException()
+        if write_behind:
+            cls.add_delta(image_id, 1)
+        return like_id
+
+    # Returns the id of the image the like was placed on
+    @classmethod
+    async def remove(cls, current_user: UserSnapshot, like_id: uuid.UUID) -> uuid.UUID:
+        write_behind = cls.is_write_behind()
+        image_id = await LikeDAO.remove(like_id, current_user.id, update_count=not write_behind)
+        if image_id is None:
+            if await LikeDAO.find_one_or_none_by_id(like_id) is None:
+                raise LikeNotFoundException()
+            raise NoAccessToLikeException()
+        if write_behind:
+            cls.add_delta(image_id, -1)
+        return image_id
+
+    @classmethod
+    def add_delta(cls, image_id: uuid.UUID, delta: int) -> None:
+        cls.deltas[image_id] = cls.deltas.get(image_id, 0) + delta
+
+    @classmethod
+    async def flush(cls) -> None:
+        deltas, cls.deltas = cls.deltas, {}
+        if not deltas:
+            return
+        try:
+            await ImageDAO.add_to_like_counts(deltas)
+            cls.flushes += 1
+        except Exception as e:
+            # The changes are kept to be written by the next flush
+            for image_id, delta in deltas.items():
+                cls.add_delta(image_id, delta)
+            cls.flush_errors += 1
+            logging.error(f'Failed to update like counters of {len(deltas)} images: {e}')
+
+    @classmethod
+    async def flush_periodically(cls) -> None:
+        while True:
+            await asyncio.sleep(SETTINGS.LIKES.FLUSH_INTERVAL_SECONDS)
+            await cls.flush()
+
+    @classmethod
+    def get_metrics(cls) -> dict[str, int | bool]:
+        return {
+            'write_behind': cls.is_write_behind(),
+            'pending_images': len(cls.deltas),
+            'flushes': cls.flushes,
+            'flush_errors': cls.flush_errors
+        }
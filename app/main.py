@@ -1,5 +1,8 @@
 import asyncio
 import logging
+import os
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 
 import uvicorn
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
@@ -9,24 +12,51 @@ from fastapi.staticfiles import StaticFiles
 from app.config import SETTINGS, BASE_DIR
 from app.database import create_tables
 from app.exception_handlers import init_exception_handlers
+from app.generation.queue import GenerationQueue
+from app.likes.service import LikeService
+from app.jobs.delete_old_generation_jobs import job_delete_old_generation_jobs
 from app.jobs.update_daily_generations import job_update_daily_generations
-from app.routers import pages, images, auth, likes
+from app.jobs.update_trending_scores import job_update_trending_scores
+from app.routers import pages, images, auth, likes, metrics, users
+from app.storage.static import ImmutableStaticFiles
+from app.utils.api_calls.http_client import HttpClient
+from app.utils.password_hasher import PasswordHasher
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    PasswordHasher.start()
+    await HttpClient.start()
+    await GenerationQueue.start()
+    LikeService.start()
+    yield
+    await LikeService.stop()
+    await GenerationQueue.stop()
+    await HttpClient.close()
+    PasswordHasher.close()
 
 
 async def main() -> None:
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
 
     app.mount('/static', StaticFiles(directory=f'{BASE_DIR}/app/static'), name='static')
+    if SETTINGS.STORAGE.BACKEND == 'local':
+        os.makedirs(SETTINGS.STORAGE.LOCAL_DIRECTORY, exist_ok=True)
+        app.mount('/media', ImmutableStaticFiles(directory=SETTINGS.STORAGE.LOCAL_DIRECTORY), name='media')
 
     app.include_router(pages.router)
     app.include_router(images.router)
     app.include_router(auth.router)
     app.include_router(likes.router)
+    app.include_router(users.router)
+    app.include_router(metrics.router)
 
     init_exception_handlers(app)
 
     scheduler = AsyncIOScheduler(timezone=SETTINGS.TIME_ZONE)
     scheduler.add_job(job_update_daily_generations, 'cron', hour=0, minute=1)
+    scheduler.add_job(job_delete_old_generation_jobs, 'interval', hours=1)
+    scheduler.add_job(job_update_trending_scores, 'interval', minutes=SETTINGS.TRENDING.UPDATE_INTERVAL_MINUTES)
     scheduler.start()
 
     logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
@@ -1,19 +1,20 @@
 import logging
 
-from fastapi import Response, APIRouter
+from fastapi import Response, APIRouter, Request
 
 from app.dao.dao import UserDAO
 from app.dependencies import CurrentUser, CurrentUserRefresh
 from app.exceptions import UsernameTakenException, EmailTakenException
 from app.schemas import RequestLogin, RequestRegister
 from app.utils.auth import authenticate_user, get_password_hash, set_access_token, \
-    set_refresh_token, delete_access_token, delete_refresh_token
+    set_refresh_token, delete_access_token, delete_refresh_token, check_login_rate_limit
 
 router = APIRouter(prefix='/api/auth')
 
 
 @router.post('/login')
-async def login_user(login_data: RequestLogin, response: Response) -> dict:
+async def login_user(login_data: RequestLogin, response: Response, request: Request) -> dict:
+    check_login_rate_limit(login_data.username, request)
     user = await authenticate_user(login_data.username, login_data.password)
     set_access_token(user, response)
     set_refresh_token(user, response)
@@ -35,7 +36,7 @@ async def register_user(register_data: RequestRegister) -> dict:
     if await UserDAO.find_one_or_none(email=register_data.email):
         raise EmailTakenException()
     user = await UserDAO.add(username=register_data.username, email=register_data.email,
-                             hashed_password=get_password_hash(register_data.password))
+                             hashed_password=await get_password_hash(register_data.password))
     logging.info(f'Registered user with id {user.id}')
     return {'message': 'successfully registered new user'}
 
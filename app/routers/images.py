@@ -1,35 +1,137 @@
 import logging
+import math
+import uuid
+from collections.abc import AsyncIterator
 
-from fastapi import APIRouter
+from fastapi import APIRouter, status, Response
 from fastapi import Request
+from fastapi.responses import StreamingResponse
 
+from app.config import SETTINGS
 from app.dao.dao import ImageDAO, UserDAO
+from app.dao.load_profiles import GALLERY_CARD
+from app.database import GenerationJobStatus
 from app.dependencies import CurrentUser, ImageById
-from app.exceptions import GeneratingImageException, NoAccessToImageException, NoGenerationLeftException
-from app.schemas import RequestGenerateImage
-from app.utils.api_calls.cloudflare import generate_image_from_prompt, generate_tags_for_image
-from app.utils.api_calls.imgbb import upload_image_to_imgbb
+from app.exceptions import NoAccessToImageException, NoGenerationLeftException, GenerationJobNotFoundException, \
+    GenerationUnavailableException
+from app.generation.queue import GenerationQueue
+from app.schemas import RequestGenerateImage, SearchQuery, GalleryPage, GalleryCard, RequestGenerateImages
+from app.utils.api_calls.cloudflare import images_upstream
+from app.utils.page_cache import make_version, make_etag, is_not_modified
 
 router = APIRouter(prefix='/api/images')
 
+# Number of images loaded from the database at once by the streaming endpoint
+STREAM_BATCH_SIZE = 100
 
-@router.post('/create')
+
+# Public gallery for clients that render it themselves. Paginated by page number, or by cursor when the cursor
+# parameter is present (an empty cursor requests the first page). The response is the same for all users, so it can be
+# cached by proxies for the time to live of the gallery cache
+@router.get('')
+async def get_images(search_query: SearchQuery, request: Request) -> Response:
+    if search_query.cursor is not None:
+        images, next_cursor, prev_cursor = await ImageDAO.find_all_by_cursor(
+            sort_by=search_query.sort_by, order_by=search_query.order_by, term=search_query.term,
+            tag_mode=search_query.tag_mode, cursor=search_query.cursor, page_size=search_query.page_size,
+            profile=GALLERY_CARD, is_public=True)
+        total_pages = None
+    else:
+        images, total_pages = await ImageDAO.find_all_with_filters(
+            sort_by=search_query.sort_by, order_by=search_query.order_by, term=search_query.term,
+            tag_mode=search_query.tag_mode, page=search_query.page, page_size=search_query.page_size,
+            profile=GALLERY_CARD, is_public=True)
+        next_cursor, prev_cursor = None, None
+    version = make_version(search_query.model_dump(), total_pages,
+                           [(image.id, image.updated_at, image.like_count) for image in images])
+    headers = {'ETag': make_etag(version, None),
+               'Cache-Control': f'public, max-age={SETTINGS.CACHE.GALLERY_TTL_SECONDS}'}
+    if is_not_modified(request, headers['ETag']):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    page = GalleryPage(images=[GalleryCard.model_validate(image) for image in images], total_pages=total_pages,
+                       next_cursor=next_cursor, prev_cursor=prev_cursor)
+    return Response(page.model_dump_json(), media_type='application/json', headers=headers)
+
+
+# All public images matching the query as newline-delimited JSON, one card per line. Images are loaded in batches
+# by cursor, so the memory used does not depend on the number of images
+@router.get('/stream')
+async def stream_images(search_query: SearchQuery) -> StreamingResponse:
+    async def generate_lines() -> AsyncIterator[str]:
+        cursor = search_query.cursor
+        while True:
+            images, cursor, _ = await ImageDAO.find_all_by_cursor(
+                sort_by=search_query.sort_by, order_by=search_query.order_by, term=search_query.term,
+                tag_mode=search_query.tag_mode, cursor=cursor, page_size=STREAM_BATCH_SIZE,
+                profile=GALLERY_CARD, is_public=True)
+            for image in images:
+                yield GalleryCard.model_validate(image).model_dump_json() + '\n'
+            if cursor is None:
+                break
+
+    return StreamingResponse(generate_lines(), media_type='application/x-ndjson')
+
+
+# While the generation API is down, generations would only take the workers and fail, so they are not accepted
+def check_generation_available() -> None:
+    if images_upstream.breaker.get_state() == 'open':
+        retry_after = math.ceil(images_upstream.breaker.get_retry_after())
+        raise GenerationUnavailableException(headers={'Retry-After': str(retry_after)})
+
+
+@router.post('/create', status_code=status.HTTP_202_ACCEPTED)
 async def create_image(current_user: CurrentUser, generate_data: RequestGenerateImage, request: Request) -> dict:
-    if current_user.generations_left <= 0:
-        raise NoGenerationLeftException()
+    check_generation_available()
+    GenerationQueue.admit(current_user.id)
+    try:
+        if await UserDAO.reserve_generations_by_id(current_user.id) is None:
+            raise NoGenerationLeftException()
+        try:
+            job = await GenerationQueue.enqueue(current_user.id, generate_data.prompt, generate_data.use_cache)
+        except Exception:
+            await UserDAO.refund_generations_by_id(current_user.id)
+            raise
+    except Exception:
+        GenerationQueue.release(current_user.id)
+        raise
+    return {'job_id': str(job.id), 'job_url': str(request.url_for('get_generation_job', job_id=str(job.id)))}
+
+
+# Generates images by several prompts in one request. The prompts are admitted and the generations are reserved once
+# for the whole batch, and the jobs are created together. Each prompt is a job run by the workers like the jobs
+# of /create, generations of the jobs that fail are refunded. Images of the jobs that finish together are stored
+# together. The result of each prompt is available by the URL of its job
+@router.post('/create-batch', status_code=status.HTTP_202_ACCEPTED)
+async def create_images(current_user: CurrentUser, generate_data: RequestGenerateImages, request: Request) -> dict:
+    check_generation_available()
+    count = len(generate_data.prompts)
+    GenerationQueue.admit(current_user.id, count)
     try:
-        img_data = await generate_image_from_prompt(generate_data.prompt)
-        tag_names = await generate_tags_for_image(img_data, generate_data.prompt)
-        image_url = await upload_image_to_imgbb(img_data)
-        image = await ImageDAO.add(url=image_url, prompt=generate_data.prompt, author_id=current_user.id)
-        logging.info(f'Created image with id {image.id}')
-        await ImageDAO.create_tags_for_image_by_id(image.id, tag_names)
-        logging.info(f'Created tags for image with id {image.id}')
-        await UserDAO.decrease_generations_by_id(current_user.id)
-        return {'image_url': str(request.url_for('get_image_page', image_id=str(image.id)))}
-    except Exception as e:
-        logging.error(f'Error while generating image: {e}', exc_info=True)
-        raise GeneratingImageException()
+        if await UserDAO.reserve_generations_by_id(current_user.id, count=count) is None:
+            raise NoGenerationLeftException()
+        try:
+            jobs = await GenerationQueue.enqueue_many(current_user.id, generate_data.prompts, generate_data.use_cache)
+        except Exception:
+            await UserDAO.refund_generations_by_id(current_user.id, count=count)
+            raise
+    except Exception:
+        GenerationQueue.release(current_user.id, count)
+        raise
+    return {'jobs': [{'prompt': job.prompt, 'job_id': str(job.id),
+                      'job_url': str(request.url_for('get_generation_job', job_id=str(job.id)))} for job in jobs]}
+
+
+@router.get('/jobs/{job_id}')
+async def get_generation_job(job_id: uuid.UUID, current_user: CurrentUser, request: Request) -> dict:
+    job = await GenerationQueue.get_job(job_id)
+    if job is None or job.user_id != current_user.id:
+        raise GenerationJobNotFoundException()
+    result = {'job_id': str(job.id), 'status': job.status}
+    if job.status == GenerationJobStatus.DONE and job.image_id is not None:
+        result['image_url'] = str(request.url_for('get_image_page', image_id=str(job.image_id)))
+    elif job.status == GenerationJobStatus.FAILED:
+        result['detail'] = job.error
+    return result
 
 
 @router.delete('/delete/{image_id}')
@@ -0,0 +1,27 @@
+from fastapi import APIRouter
+
+from app.dao.dao import user_cache, gallery_cache
+from app.generation.cache import GenerationCache
+from app.generation.queue import GenerationQueue
+from app.likes.service import LikeService
+from app.utils.api_calls.http_client import HttpClient
+from app.utils.api_calls.resilience import Upstream
+from app.utils.page_cache import fragment_cache
+from app.utils.password_hasher import PasswordHasher
+
+router = APIRouter(prefix='/api/metrics')
+
+
+@router.get('')
+async def get_metrics() -> dict:
+    return {
+        'http_client': HttpClient.get_metrics(),
+        'upstreams': Upstream.get_all_metrics(),
+        'generation_queue': GenerationQueue.get_metrics(),
+        'generation_cache': GenerationCache.get_metrics(),
+        'user_cache': user_cache.get_metrics(),
+        'gallery_cache': gallery_cache.get_metrics(),
+        'fragment_cache': fragment_cache.get_metrics(),
+        'password_hasher': PasswordHasher.get_metrics(),
+        'likes': LikeService.get_metrics()
+    }
@@ -1,14 +1,19 @@
 from fastapi import Request, APIRouter
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, Response
 from fastapi.templating import Jinja2Templates
 
-from app.config import BASE_DIR
+from app.config import BASE_DIR, SETTINGS
 from app.dao.dao import ImageDAO
+from app.dao.load_profiles import GALLERY_PAGE_CARD, IMAGE_PAGE
 from app.dependencies import OptionalCurrentUser, CurrentUser, UserById, ImageById, LikeByImage
-from app.schemas import SearchQuery
+from app.schemas import SearchQuery, ProfileQuery
+from app.utils.page_cache import make_version, make_etag, is_not_modified, not_modified_response, \
+    set_cache_headers, get_fragment, render_fragment
 
 router = APIRouter()
 templates = Jinja2Templates(directory=f'{BASE_DIR}/app/templates')
+templates.env.globals.update(thumbnail_width=SETTINGS.GENERATION.THUMBNAIL_WIDTH,
+                             image_width=SETTINGS.CLOUDFLARE.IMAGE_WIDTH)
 
 
 @router.get('/')
@@ -17,8 +22,14 @@ async def home_page(current_user: OptionalCurrentUser, request: Request) -> HTML
 
 
 @router.get('/users/me')
-async def get_me_page(current_user: CurrentUser, request: Request) -> HTMLResponse:
-    return templates.TemplateResponse(request=request, name='get_me.html', context={'current_user': current_user})
+async def get_me_page(current_user: CurrentUser, profile_query: ProfileQuery, request: Request) -> HTMLResponse:
+    images, total_pages, next_cursor, prev_cursor = await ImageDAO.find_all_by_author(
+        current_user.id, include_private=True, page=profile_query.page, cursor=profile_query.cursor,
+        page_size=profile_query.page_size)
+    return templates.TemplateResponse(request=request, name='get_me.html',
+                                      context={'current_user': current_user, 'images': images,
+                                               'profile_query': profile_query, 'total_pages': total_pages,
+                                               'next_cursor': next_cursor, 'prev_cursor': prev_cursor})
 
 
 @router.get('/users/login')
@@ -33,11 +44,25 @@ async def register_user_page(current_user: OptionalCurrentUser, request: Request
 
 
 @router.get('/users/{user_id}')
-async def get_user_page(user: UserById, current_user: OptionalCurrentUser, request: Request) -> HTMLResponse:
+async def get_user_page(user: UserById, current_user: OptionalCurrentUser, profile_query: ProfileQuery,
+                        request: Request) -> Response:
     if current_user is not None and user.id == current_user.id:
         return RedirectResponse(request.url_for('get_me_page'))
-    return templates.TemplateResponse(request=request, name='get_user.html',
-                                      context={'current_user': current_user, 'user': user})
+    images, total_pages, next_cursor, prev_cursor = await ImageDAO.find_all_by_author(
+        user.id, page=profile_query.page, cursor=profile_query.cursor, page_size=profile_query.page_size)
+    version = make_version(user.id, user.updated_at, profile_query.model_dump(), total_pages,
+                           [(image.id, image.updated_at, image.like_count) for image in images])
+    etag = make_etag(version, current_user)
+    if is_not_modified(request, etag):
+        return not_modified_response(etag, current_user)
+    content = get_fragment(request, 'fragments/user_profile.html', version)
+    if content is None:
+        content = render_fragment(templates, request, 'fragments/user_profile.html', version,
+                                  user=user, images=images, profile_query=profile_query, total_pages=total_pages,
+                                  next_cursor=next_cursor, prev_cursor=prev_cursor)
+    response = templates.TemplateResponse(request=request, name='get_user.html',
+                                          context={'current_user': current_user, 'content': content})
+    return set_cache_headers(response, etag, current_user)
 
 
 @router.get('/images/create')
@@ -48,18 +73,49 @@ async def create_image_page(current_user: CurrentUser, request: Request) -> HTML
 
 @router.get('/images')
 async def get_all_images_page(current_user: OptionalCurrentUser, search_query: SearchQuery,
-                              request: Request) -> HTMLResponse:
-    images, total_pages = await ImageDAO.find_all_with_filters(sort_by=search_query.sort_by,
-                                                               order_by=search_query.order_by,
-                                                               term=search_query.term, page=search_query.page,
-                                                               page_size=search_query.page_size, is_public=True)
-    return templates.TemplateResponse(request=request, name='get_all_images.html',
-                                      context={'current_user': current_user, 'images': images,
-                                               'search_query': search_query, 'total_pages': total_pages})
+                              request: Request) -> Response:
+    if search_query.cursor is not None:
+        images, next_cursor, prev_cursor = await ImageDAO.find_all_by_cursor(
+            sort_by=search_query.sort_by, order_by=search_query.order_by, term=search_query.term,
+            tag_mode=search_query.tag_mode, cursor=search_query.cursor, page_size=search_query.page_size,
+            profile=GALLERY_PAGE_CARD, is_public=True)
+        total_pages = None
+    else:
+        images, total_pages = await ImageDAO.find_all_with_filters(
+            sort_by=search_query.sort_by, order_by=search_query.order_by, term=search_query.term,
+            tag_mode=search_query.tag_mode, page=search_query.page, page_size=search_query.page_size,
+            profile=GALLERY_PAGE_CARD, is_public=True)
+        next_cursor, prev_cursor = None, None
+    version = make_version(search_query.model_dump(), total_pages,
+                           [(image.id, image.updated_at, image.like_count) for image in images])
+    etag = make_etag(version, current_user)
+    if is_not_modified(request, etag):
+        return not_modified_response(etag, current_user)
+    content = get_fragment(request, 'fragments/gallery.html', version)
+    if content is None:
+        content = render_fragment(templates, request, 'fragments/gallery.html', version,
+                                  images=images, search_query=search_query, total_pages=total_pages,
+                                  next_cursor=next_cursor, prev_cursor=prev_cursor)
+    response = templates.TemplateResponse(request=request, name='get_all_images.html',
+                                          context={'current_user': current_user, 'content': content})
+    return set_cache_headers(response, etag, current_user)
 
 
 @router.get('/images/{image_id}')
 async def get_image_page(image: ImageById, like: LikeByImage, current_user: OptionalCurrentUser,
-                         request: Request) -> HTMLResponse:
-    return templates.TemplateResponse(request=request, name='get_image.html',
-                                      context={'current_user': current_user, 'image': image, 'like': like})
+                         request: Request) -> Response:
+    like_id = like.id if like else None
+    version = make_version(image.id, image.updated_at)
+    etag = make_etag(make_version(version, image.is_public, image.like_count, like_id), current_user)
+    if is_not_modified(request, etag):
+        return not_modified_response(etag, current_user)
+    # Author and tags are loaded only when the details are not cached
+    content = get_fragment(request, 'fragments/image_details.html', version)
+    if content is None:
+        image_with_details = await ImageDAO.find_one_or_none_by_id(image.id, profile=IMAGE_PAGE)
+        content = render_fragment(templates, request, 'fragments/image_details.html', version,
+                                  image=image_with_details)
+    response = templates.TemplateResponse(request=request, name='get_image.html',
+                                          context={'current_user': current_user, 'image': image, 'like': like,
+                                                   'content': content})
+    return set_cache_headers(response, etag, current_user)
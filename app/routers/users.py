@@ -0,0 +1,21 @@
+from fastapi import APIRouter
+
+from app.dao.dao import ImageDAO
+from app.dependencies import OptionalCurrentUser, UserById
+from app.schemas import ProfileQuery, ImageCard
+
+router = APIRouter(prefix='/api/users')
+
+
+@router.get('/{user_id}/images')
+async def get_user_images(user: UserById, current_user: OptionalCurrentUser, profile_query: ProfileQuery) -> dict:
+    include_private = current_user is not None and current_user.id == user.id
+    images, total_pages, next_cursor, prev_cursor = await ImageDAO.find_all_by_author(
+        user.id, include_private=include_private, page=profile_query.page, cursor=profile_query.cursor,
+        page_size=profile_query.page_size)
+    return {
+        'images': [ImageCard.model_validate(image) for image in images],
+        'total_pages': total_pages,
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor
+    }
@@ -1,9 +1,12 @@
 import uuid
+from datetime import datetime
 from typing import Self, Literal, Annotated
 
 from fastapi import Query
 from pydantic import BaseModel, EmailStr, Field, model_validator, ConfigDict, AfterValidator
 
+from app.config import SETTINGS
+
 
 # Field description is the message that will appear when a validation error occurs
 class Base(BaseModel):
@@ -20,19 +23,94 @@ def validate_search_term(value: str | None) -> str | None:
     return None
 
 
+# Columns of the user needed by the handlers, stored in the cache of authenticated users
+class UserSnapshot(Base):
+    model_config = ConfigDict(from_attributes=True)
+    id: uuid.UUID
+    username: str
+    email: str
+    generations_left: int
+    created_at: datetime
+
+
 class RequestSearchQuery(Base):
-    sort_by: Literal['date', 'likes'] = 'likes'
+    sort_by: Literal['date', 'likes', 'relevance', 'trending'] = 'likes'
     order_by: Literal['asc', 'desc'] = 'desc'
     term: Annotated[str | None, AfterValidator(validate_search_term)] = None
+    # Whether images must have all of the tags from the term or any of them
+    tag_mode: Literal['all', 'any'] = 'all'
     page: int = Field(default=1, ge=1)
     page_size: int = Field(default=9, ge=1, le=100)
+    # Opaque cursor for keyset pagination, replaces page when present
+    cursor: str | None = None
 
 
 SearchQuery = Annotated[RequestSearchQuery, Query()]
 
 
+class RequestProfileQuery(Base):
+    page: int = Field(default=1, ge=1)
+    page_size: int = Field(default=12, ge=1, le=100)
+    # Opaque cursor for keyset pagination, replaces page when present
+    cursor: str | None = None
+
+
+ProfileQuery = Annotated[RequestProfileQuery, Query()]
+
+
+# Image as it is shown in galleries
+class ImageCard(Base):
+    model_config = ConfigDict(from_attributes=True)
+    id: uuid.UUID
+    url: str
+    is_public: bool
+    like_count: int
+    created_at: datetime
+
+
+class AuthorCard(Base):
+    model_config = ConfigDict(from_attributes=True)
+    id: uuid.UUID
+    username: str
+
+
+# Image of the public gallery. Built from the columns loaded by the GALLERY_CARD profile
+class GalleryCard(Base):
+    model_config = ConfigDict(from_attributes=True)
+    id: uuid.UUID
+    url: str
+    # The original image is used for images without variants
+    thumb: str | None = Field(validation_alias='thumb_url')
+    like_count: int
+    created_at: datetime
+    author: AuthorCard
+
+    @model_validator(mode='after')
+    def use_original_as_thumb(self) -> Self:
+        if self.thumb is None:
+            self.thumb = self.url
+        return self
+
+
+class GalleryPage(Base):
+    model_config = ConfigDict(from_attributes=True)
+    images: list[GalleryCard]
+    total_pages: int | None
+    next_cursor: str | None
+    prev_cursor: str | None
+
+
 class RequestGenerateImage(Base):
     prompt: str = Field(min_length=3, max_length=200, description='Prompt must be between 3 and 200 characters long')
+    # Whether an image generated recently by the same prompt can be reused
+    use_cache: bool = True
+
+
+class RequestGenerateImages(Base):
+    prompts: list[Annotated[str, Field(min_length=3, max_length=200)]] = Field(
+        min_length=1, max_length=SETTINGS.GENERATION.MAX_BATCH_SIZE,
+        description=f'From 1 to {SETTINGS.GENERATION.MAX_BATCH_SIZE} prompts between 3 and 200 characters long')
+    use_cache: bool = True
 
 
 class RequestPlaceLike(Base):
@@ -1,4 +1,5 @@
 const prompt = document.getElementById("prompt");
+const useCache = document.getElementById("use_cache");
 const button = document.getElementById("create_button");
 
 function disableButton() {
@@ -11,6 +12,28 @@ function enableButton() {
     button.disabled = false;
 }
 
+function sleep(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+// The image is generated in the background, so the job is polled until it is finished
+async function waitForJob(jobUrl) {
+    while (true) {
+        await sleep(2000);
+        const response = await fetch(jobUrl);
+        const result = await response.json();
+        if (!response.ok || result.status === "failed") {
+            showErrorText(result.detail);
+            enableButton();
+            return;
+        }
+        if (result.status === "done") {
+            redirectTo(result.image_url);
+            return;
+        }
+    }
+}
+
 button.addEventListener("click", async () => {
     if (!prompt.value.trim()) {
         showErrorText("Please enter a prompt");
@@ -19,7 +42,8 @@ button.addEventListener("click", async () => {
 
     disableButton();
     const body = JSON.stringify({
-        prompt: prompt.value
+        prompt: prompt.value,
+        use_cache: useCache.checked
     });
 
     try {
@@ -33,7 +57,7 @@ button.addEventListener("click", async () => {
 
         if (response.ok) {
             const result = await response.json();
-            redirectTo(result.image_url);
+            await waitForJob(result.job_url);
         } else {
             const result = await response.json();
             showErrorText(result.detail);
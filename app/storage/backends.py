@@ -0,0 +1,85 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from aiohttp import ClientTimeout
+
+from app.config import SETTINGS
+from app.utils.api_calls.http_client import HttpClient
+from app.utils.api_calls.imgbb import upload_image_to_imgbb
+
+FILE_EXTENSIONS = {'image/jpeg': 'jpg', 'image/webp': 'webp'}
+
+
+# Storage of generated images
+class ImageStorage(ABC):
+    # Stores the image and returns its URL
+    @abstractmethod
+    async def save(self, data: bytes, content_type: str = 'image/jpeg') -> str:
+        pass
+
+    # Returns the content of an image stored by the URL. Images that are not on the local disk are hosted by imgbb
+    async def load(self, url: str) -> bytes:
+        timeout = ClientTimeout(total=SETTINGS.IMGBB.REQUEST_TIMEOUT_SECONDS,
+                                sock_connect=SETTINGS.IMGBB.CONNECT_TIMEOUT_SECONDS,
+                                sock_read=SETTINGS.IMGBB.READ_TIMEOUT_SECONDS)
+        async with HttpClient.get_session().get(url, timeout=timeout) as resp:
+            resp.raise_for_status()
+            return await resp.read()
+
+
+class ImgbbStorage(ImageStorage):
+    async def save(self, data: bytes, content_type: str = 'image/jpeg') -> str:
+        return await upload_image_to_imgbb(data, content_type)
+
+
+# Images are stored on the local disk by the hash of their content, so a file never changes and can be cached forever.
+# Files are spread over two levels of directories by the first characters of the hash
+class LocalStorage(ImageStorage):
+    def __init__(self, directory: str, public_url: str):
+        self.directory = Path(directory)
+        self.public_url = public_url.rstrip('/')
+
+    async def save(self, data: bytes, content_type: str = 'image/jpeg') -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        relative_path = f'{digest[:2]}/{digest[2:4]}/{digest}.{FILE_EXTENSIONS[content_type]}'
+        await asyncio.to_thread(self.write_file, self.directory / relative_path, data)
+        return f'{self.public_url}/{relative_path}'
+
+    async def load(self, url: str) -> bytes:
+        if not url.startswith(f'{self.public_url}/'):
+            return await super().load(url)
+        return await asyncio.to_thread((self.directory / url.removeprefix(f'{self.public_url}/')).read_bytes)
+
+    # The file is written under a temporary name and renamed, so it is never served partially written
+    @staticmethod
+    def write_file(path: Path, data: bytes) -> None:
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+
+storage: ImageStorage | None = None
+
+
+def get_storage() -> ImageStorage:
+    global storage
+    if storage is None:
+        if SETTINGS.STORAGE.BACKEND == 'local':
+            storage = LocalStorage(SETTINGS.STORAGE.LOCAL_DIRECTORY, SETTINGS.STORAGE.PUBLIC_URL)
+        else:
+            storage = ImgbbStorage()
+    return storage
@@ -0,0 +1,14 @@
+import os
+
+from fastapi.staticfiles import StaticFiles
+from starlette.responses import Response
+from starlette.types import Scope
+
+
+# Serves files that never change, so browsers and proxies can cache them without revalidation
+class ImmutableStaticFiles(StaticFiles):
+    def file_response(self, full_path: str | os.PathLike[str], stat_result: os.stat_result, scope: Scope,
+                      status_code: int = 200) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response
@@ -1,18 +1,33 @@
+import json
 import logging
 
-from aiohttp import ClientSession, ClientTimeout
+from aiohttp import ClientResponse
 from pydantic import BaseModel, Field
 
 from app.config import SETTINGS
+from app.utils.api_calls.resilience import Upstream
+from app.utils.image_payload import ImagePayload, Base64FieldDecoder
+
+RESPONSE_CHUNK_SIZE = 64 * 1024
+# Stands for the image in the JSON of the tagging request until the image is inserted into the encoded request
+IMAGE_PLACEHOLDER = '__image_data_url__'
+
+images_upstream = Upstream('cloudflare_images', SETTINGS.CLOUDFLARE.IMAGES_MAX_ATTEMPTS,
+                           SETTINGS.CLOUDFLARE.CONNECT_TIMEOUT_SECONDS, SETTINGS.CLOUDFLARE.READ_TIMEOUT_SECONDS,
+                           SETTINGS.CLOUDFLARE.REQUEST_TIMEOUT_SECONDS)
+tags_upstream = Upstream('cloudflare_tags', SETTINGS.CLOUDFLARE.TAGS_MAX_ATTEMPTS,
+                         SETTINGS.CLOUDFLARE.CONNECT_TIMEOUT_SECONDS, SETTINGS.CLOUDFLARE.READ_TIMEOUT_SECONDS,
+                         SETTINGS.CLOUDFLARE.REQUEST_TIMEOUT_SECONDS)
 
 
 class TagsResponseFormat(BaseModel):
     tags: list[str] = Field(min_length=1, max_length=10)
 
 
-async def generate_image_from_prompt(prompt: str) -> str:
+# The response is read by chunks and the image is decoded while it arrives
+async def generate_image_from_prompt(prompt: str) -> ImagePayload:
     logging.info(f'Generating image with prompt: {prompt}')
-    link = f'https://api.cloudflare.com/client/v4/accounts/{SETTINGS.CLOUDFLARE.ACCOUNT_ID}/ai/run/{SETTINGS.CLOUDFLARE.IMAGES_MODEL_NAME}'
+    link = f'{SETTINGS.CLOUDFLARE.BASE_URL}/accounts/{SETTINGS.CLOUDFLARE.ACCOUNT_ID}/ai/run/{SETTINGS.CLOUDFLARE.IMAGES_MODEL_NAME}'
     headers = {
         'Authorization': f'Bearer {SETTINGS.CLOUDFLARE.API_KEY.get_secret_value()}'
     }
@@ -21,19 +36,26 @@ async def generate_image_from_prompt(prompt: str) -> str:
         'height': SETTINGS.CLOUDFLARE.IMAGE_HEIGHT,
         'width': SETTINGS.CLOUDFLARE.IMAGE_WIDTH,
     }
-    async with ClientSession() as session:
-        resp = await session.post(link, json=data, headers=headers,
-                                  timeout=ClientTimeout(total=SETTINGS.CLOUDFLARE.REQUEST_TIMEOUT_SECONDS))
-        json = await resp.json()
-        img_data = json['result']['image']
-        return img_data
+
+    async def read_image(resp: ClientResponse) -> ImagePayload:
+        decoder = Base64FieldDecoder('image')
+        async for chunk in resp.content.iter_chunked(RESPONSE_CHUNK_SIZE):
+            decoder.feed(chunk)
+            if decoder.done:
+                break
+        return ImagePayload(decoder.result())
+
+    return await images_upstream.request('POST', link, read_image, lambda: {'json': data, 'headers': headers})
 
 
-async def generate_tags_for_image(img_data: str, prompt: str) -> list[str]:
+# The image is encoded to base64 only for this request and inserted into the already encoded JSON, so the JSON encoder
+# does not copy it. The request can be hedged, because tagging the same image twice does no harm
+async def generate_tags_for_image(image: ImagePayload, prompt: str) -> list[str]:
     logging.info('Generating tags for image')
-    link = f'https://api.cloudflare.com/client/v4/accounts/{SETTINGS.CLOUDFLARE.ACCOUNT_ID}/ai/run/{SETTINGS.CLOUDFLARE.TAGS_MODEL_NAME}'
+    link = f'{SETTINGS.CLOUDFLARE.BASE_URL}/accounts/{SETTINGS.CLOUDFLARE.ACCOUNT_ID}/ai/run/{SETTINGS.CLOUDFLARE.TAGS_MODEL_NAME}'
     headers = {
-        'Authorization': f'Bearer {SETTINGS.CLOUDFLARE.API_KEY.get_secret_value()}'
+        'Authorization': f'Bearer {SETTINGS.CLOUDFLARE.API_KEY.get_secret_value()}',
+        'Content-Type': 'application/json'
     }
     data = {
         'messages': [
@@ -49,7 +71,7 @@ async def generate_tags_for_image(img_data: str, prompt: str) -> list[str]:
                     {
                         'type': 'image_url',
                         'image_url': {
-                            'url': f'data:image/jpeg;base64,{img_data}'
+                            'url': IMAGE_PLACEHOLDER
                         }
                     }
                 ]
@@ -57,10 +79,18 @@ async def generate_tags_for_image(img_data: str, prompt: str) -> list[str]:
         ],
         'guided_json': TagsResponseFormat.model_json_schema()
     }
-    async with ClientSession() as session:
-        resp = await session.post(link, json=data, headers=headers,
-                                  timeout=ClientTimeout(total=SETTINGS.CLOUDFLARE.REQUEST_TIMEOUT_SECONDS))
-        json = await resp.json()
-        tags = json['result']['response']['tags']
-        tags = [tag.lower().replace(' ', '_').replace('-', '_') for tag in tags]
-        return tags
+    before_image, after_image = json.dumps(data).encode().split(f'"{IMAGE_PLACEHOLDER}"'.encode())
+    body = b''.join((before_image, b'"', image.to_data_url(), b'"', after_image))
+
+    async def read_tags(resp: ClientResponse) -> list[str]:
+        response = await resp.json()
+        tags = response['result']['response']['tags']
+        return [tag.lower().replace(' ', '_').replace('-', '_') for tag in tags]
+
+    def make_arguments() -> dict:
+        return {'data': body, 'headers': headers}
+
+    if SETTINGS.CLOUDFLARE.TAGS_HEDGE_DELAY_SECONDS > 0:
+        return await tags_upstream.hedged_request('POST', link, read_tags, make_arguments,
+                                                  SETTINGS.CLOUDFLARE.TAGS_HEDGE_DELAY_SECONDS)
+    return await tags_upstream.request('POST', link, read_tags, make_arguments)
@@ -0,0 +1,70 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import io
+import random
+import uuid
+
+from PIL import Image as PillowImage
+from aiohttp import web
+
+# Fake Cloudflare and imgbb APIs for running the application and load tests without paid requests. Failures and slow
+# responses of the real APIs can be simulated. Run with: python -m app.utils.api_calls.fake_upstream --port 8081
+# and set CLOUDFLARE_BASE_URL=http://localhost:8081/client/v4 and IMGBB_BASE_URL=http://localhost:8081/1
+
+
+def create_image(prompt: str, width: int, height: int) -> bytes:
+    color = tuple(hashlib.sha256(prompt.encode()).digest()[:3])
+    buffer = io.BytesIO()
+    PillowImage.new('RGB', (width, height), color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def create_app(failure_rate: float = 0, latency: float = 0) -> web.Application:
+    uploads: dict[str, tuple[bytes, str]] = {}
+
+    @web.middleware
+    async def simulate_upstream(request: web.Request, handler) -> web.StreamResponse:
+        if latency:
+            await asyncio.sleep(random.uniform(0, 2 * latency))
+        if request.method == 'POST' and random.random() < failure_rate:
+            return web.json_response({'success': False, 'errors': [{'message': 'Simulated failure'}]}, status=503)
+        return await handler(request)
+
+    async def run_model(request: web.Request) -> web.Response:
+        data = await request.json()
+        if 'messages' in data:
+            prompt = data['messages'][0]['content']
+            tags = ['#fake', f'#{hashlib.sha256(prompt.encode()).hexdigest()[:6]}']
+            return web.json_response({'result': {'response': {'tags': tags}}, 'success': True})
+        image = create_image(data['prompt'], data.get('width', 768), data.get('height', 1024))
+        return web.json_response({'result': {'image': base64.b64encode(image).decode()}, 'success': True})
+
+    async def upload(request: web.Request) -> web.Response:
+        field = (await request.post())['image']
+        name = f'{uuid.uuid4().hex}.{field.filename.rsplit(".", 1)[-1]}'
+        uploads[name] = (field.file.read(), field.content_type)
+        return web.json_response({'data': {'url': f'{request.url.origin()}/images/{name}'}, 'success': True})
+
+    async def get_upload(request: web.Request) -> web.Response:
+        if request.match_info['name'] not in uploads:
+            raise web.HTTPNotFound()
+        body, content_type = uploads[request.match_info['name']]
+        return web.Response(body=body, content_type=content_type)
+
+    app = web.Application(middlewares=[simulate_upstream], client_max_size=64 * 1024 * 1024)
+    app.router.add_post('/client/v4/accounts/{account_id}/ai/run/{model:.+}', run_model)
+    app.router.add_post('/1/upload', upload)
+    app.router.add_get('/images/{name}', get_upload)
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake Cloudflare and imgbb APIs')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--failure-rate', type=float, default=0, help='Part of the requests that fail with 503')
+    parser.add_argument('--latency', type=float, default=0, help='Average delay of the responses in seconds')
+    args = parser.parse_args()
+    web.run_app(create_app(args.failure_rate, args.latency), host=args.host, port=args.port)
@@ -0,0 +1,70 @@
+from collections.abc import Callable, Awaitable
+from types import SimpleNamespace
+from typing import Any
+
+from aiohttp import ClientSession, TCPConnector, TraceConfig
+
+from app.config import SETTINGS
+
+
+# Process-wide HTTP client for the external APIs. Connections are kept alive and reused between requests
+class HttpClient:
+    session: ClientSession | None = None
+    metrics: dict[str, int] = {
+        'requests': 0,
+        'requests_in_flight': 0,
+        'request_errors': 0,
+        'connections_created': 0,
+        'connections_reused': 0,
+        'dns_cache_hits': 0,
+        'dns_cache_misses': 0
+    }
+
+    @classmethod
+    async def start(cls) -> None:
+        connector = TCPConnector(limit=SETTINGS.HTTP_CLIENT.POOL_LIMIT,
+                                 limit_per_host=SETTINGS.HTTP_CLIENT.POOL_LIMIT_PER_HOST,
+                                 keepalive_timeout=SETTINGS.HTTP_CLIENT.KEEPALIVE_TIMEOUT_SECONDS,
+                                 ttl_dns_cache=SETTINGS.HTTP_CLIENT.DNS_CACHE_TTL_SECONDS)
+        cls.session = ClientSession(connector=connector, trace_configs=[cls.create_trace_config()])
+
+    @classmethod
+    async def close(cls) -> None:
+        if cls.session is not None:
+            await cls.session.close()
+            cls.session = None
+
+    @classmethod
+    def get_session(cls) -> ClientSession:
+        if cls.session is None:
+            raise RuntimeError('HTTP client is not started')
+        return cls.session
+
+    @classmethod
+    def get_metrics(cls) -> dict[str, int]:
+        metrics = dict(cls.metrics)
+        if cls.session is not None:
+            metrics['pool_limit'] = cls.session.connector.limit
+            metrics['pool_limit_per_host'] = cls.session.connector.limit_per_host
+        return metrics
+
+    # Updates the metrics on the events of the client
+    @classmethod
+    def create_trace_config(cls) -> TraceConfig:
+        def count(metric: str, value: int = 1) -> Callable[..., Awaitable[None]]:
+            async def handler(session: ClientSession, context: SimpleNamespace, params: Any) -> None:
+                cls.metrics[metric] += value
+
+            return handler
+
+        trace_config = TraceConfig()
+        trace_config.on_request_start.append(count('requests'))
+        trace_config.on_request_start.append(count('requests_in_flight'))
+        trace_config.on_request_end.append(count('requests_in_flight', -1))
+        trace_config.on_request_exception.append(count('requests_in_flight', -1))
+        trace_config.on_request_exception.append(count('request_errors'))
+        trace_config.on_connection_create_end.append(count('connections_created'))
+        trace_config.on_connection_reuseconn.append(count('connections_reused'))
+        trace_config.on_dns_cache_hit.append(count('dns_cache_hits'))
+        trace_config.on_dns_cache_miss.append(count('dns_cache_misses'))
+        return trace_config
@@ -1,24 +1,31 @@
-import base64
 import logging
 
-from aiohttp import ClientSession, FormData, ClientTimeout
+from aiohttp import FormData, ClientResponse
 
 from app.config import SETTINGS
+from app.utils.api_calls.resilience import Upstream
 
+imgbb_upstream = Upstream('imgbb', SETTINGS.IMGBB.MAX_ATTEMPTS, SETTINGS.IMGBB.CONNECT_TIMEOUT_SECONDS,
+                          SETTINGS.IMGBB.READ_TIMEOUT_SECONDS, SETTINGS.IMGBB.REQUEST_TIMEOUT_SECONDS)
 
-async def upload_image_to_imgbb(img_data: str) -> str:
+
+async def upload_image_to_imgbb(img_data: bytes, content_type: str = 'image/jpeg') -> str:
     logging.info('Uploading image to imgbb')
-    link = f'https://api.imgbb.com/1/upload?key={SETTINGS.IMGBB.API_KEY.get_secret_value()}'
-    data = FormData()
-    data.add_field(
-        name='image',
-        content_type='image/jpeg',
-        filename='image.jpeg',
-        value=base64.decodebytes(bytes(img_data, 'utf-8'))
-    )
-    async with ClientSession() as session:
-        resp = await session.post(link, data=data,
-                                  timeout=ClientTimeout(total=SETTINGS.CLOUDFLARE.REQUEST_TIMEOUT_SECONDS))
+    link = f'{SETTINGS.IMGBB.BASE_URL}/upload?key={SETTINGS.IMGBB.API_KEY.get_secret_value()}'
+
+    # FormData can be sent only once, so it is created for every attempt
+    def make_arguments() -> dict:
+        data = FormData()
+        data.add_field(
+            name='image',
+            content_type=content_type,
+            filename=f'image.{content_type.removeprefix("image/")}',
+            value=img_data
+        )
+        return {'data': data}
+
+    async def read_url(resp: ClientResponse) -> str:
         json = await resp.json()
-        image_url = json['data']['url']
-        return image_url
+        return json['data']['url']
+
+    return await imgbb_upstream.request('POST', link, read_url, make_arguments)
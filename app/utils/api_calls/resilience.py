@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import random
+import time
+from collections.abc import Callable, Awaitable
+from typing import Any, TypeVar
+
+from aiohttp import ClientResponse, ClientTimeout, ClientConnectionError, ClientPayloadError
+
+from app.config import SETTINGS
+from app.utils.api_calls.http_client import HttpClient
+
+T = TypeVar('T')
+
+# Statuses of the responses after which the request can succeed if it is sent again
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+
+# Unlike ClientResponseError, does not contain the URL of the request, which can contain an API key
+class UpstreamStatusError(Exception):
+    def __init__(self, name: str, status: int, retry_after: str | None):
+        super().__init__(f'Upstream {name} responded with status {status}')
+        self.status = status
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f'Upstream {name} is unavailable, requests are not sent for {retry_after:.0f}s')
+        self.retry_after = retry_after
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, UpstreamStatusError):
+        return error.status in RETRYABLE_STATUSES
+    return isinstance(error, (ClientConnectionError, ClientPayloadError, asyncio.TimeoutError))
+
+
+# Stops sending requests to an upstream after several failures in a row, so they fail at once instead of waiting
+# for the timeouts. After a pause one request is let through, and the circuit is closed again if it succeeds
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+        self.times_opened = 0
+        self.rejected = 0
+
+    def get_state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.reset_seconds:
+            return 'open'
+        return 'half_open'
+
+    # Seconds until a request will be let through, 0 if requests are sent now
+    def get_retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0
+        return max(self.opened_at + self.reset_seconds - time.monotonic(), 0)
+
+    # Raises CircuitOpenError if the request must not be sent. If True is returned, the request is the one that checks
+    # whether the upstream has recovered, and release must be called when it is finished
+    def acquire(self) -> bool:
+        state = self.get_state()
+        if state == 'closed':
+            return False
+        if state == 'half_open' and not self.probing:
+            self.probing = True
+            return True
+        self.rejected += 1
+        raise CircuitOpenError(self.name, self.get_retry_after() or self.reset_seconds)
+
+    def release(self) -> None:
+        self.probing = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                self.times_opened += 1
+                logging.warning(f'Circuit of upstream {self.name} is opened after {self.failures} failures')
+            self.opened_at = time.monotonic()
+
+    def get_metrics(self) -> dict[str, Any]:
+        return {
+            'state': self.get_state(),
+            'consecutive_failures': self.failures,
+            'times_opened': self.times_opened,
+            'rejected': self.rejected
+        }
+
+
+# An endpoint of an external API. Requests are retried with jittered exponential backoff on connection errors,
+# timeouts and retryable statuses, and are not sent while the circuit of the endpoint is open
+class Upstream:
+    instances: dict[str, 'Upstream'] = {}
+
+    def __init__(self, name: str, max_attempts: int, connect_timeout: float, read_timeout: float,
+                 total_timeout: float):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.timeout = ClientTimeout(total=total_timeout, sock_connect=connect_timeout, sock_read=read_timeout)
+        self.breaker = CircuitBreaker(name, SETTINGS.HTTP_CLIENT.BREAKER_FAILURE_THRESHOLD,
+                                      SETTINGS.HTTP_CLIENT.BREAKER_RESET_SECONDS)
+        self.metrics = {
+            'requests': 0,
+            'failures': 0,
+            'retries': 0,
+            'hedged_requests': 0,
+            'hedges_won': 0
+        }
+        Upstream.instances[name] = self
+
+    # Sends the request and returns what read_response returns for the response. The keyword arguments are created
+    # by make_arguments for every attempt, because a body such as FormData can be sent only once
+    async def request(self, method: str, url: str, read_response: Callable[[ClientResponse], Awaitable[T]],
+                      make_arguments: Callable[[], dict[str, Any]]) -> T:
+        attempt = 1
+        while True:
+            probing = self.breaker.acquire()
+            self.metrics['requests'] += 1
+            try:
+                async with HttpClient.get_session().request(method, url, timeout=self.timeout,
+                                                            **make_arguments()) as resp:
+                    if resp.status >= 400:
+                        raise UpstreamStatusError(self.name, resp.status, resp.headers.get('Retry-After'))
+                    result = await read_response(resp)
+            except Exception as e:
+                if not is_retryable(e):
+                    # A client error means that the upstream is healthy even though the request is wrong. Other errors,
+                    # such as a response that cannot be read, do not show whether it is healthy
+                    if isinstance(e, UpstreamStatusError) and e.status < 500:
+                        self.breaker.record_success()
+                    raise
+                self.metrics['failures'] += 1
+                self.breaker.record_failure()
+                if attempt >= self.max_attempts or self.breaker.get_state() == 'open':
+                    raise
+                delay = self.get_backoff(attempt, e)
+                logging.warning(f'Request to upstream {self.name} failed: {e!r}, retrying in {delay:.2f}s')
+                self.metrics['retries'] += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                if probing:
+                    self.breaker.release()
+            self.breaker.record_success()
+            return result
+
+    # Full jitter: a random delay up to the exponential backoff, so retries of many clients do not come at once.
+    # Retry-After of the upstream is respected if it is not longer than the maximum backoff
+    @staticmethod
+    def get_backoff(attempt: int, error: Exception) -> float:
+        max_backoff = SETTINGS.HTTP_CLIENT.RETRY_MAX_BACKOFF_SECONDS
+        if isinstance(error, UpstreamStatusError) and error.retry_after is not None and error.retry_after.isdigit():
+            return min(int(error.retry_after), max_backoff)
+        return random.uniform(0, min(SETTINGS.HTTP_CLIENT.RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1), max_backoff))
+
+    # If the request is not finished after the delay, the same request is sent again and the first successful
+    # response is used. Cuts the slow tail of the latency for idempotent requests at the cost of extra requests
+    async def hedged_request(self, method: str, url: str, read_response: Callable[[ClientResponse], Awaitable[T]],
+                             make_arguments: Callable[[], dict[str, Any]], delay: float) -> T:
+        tasks = [asyncio.create_task(self.request(method, url, read_response, make_arguments))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self.breaker.get_state() == 'closed':
+                self.metrics['hedged_requests'] += 1
+                tasks.append(asyncio.create_task(self.request(method, url, read_response, make_arguments)))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self.metrics['hedges_won'] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @classmethod
+    def get_all_metrics(cls) -> dict[str, dict[str, Any]]:
+        return {name: {**upstream.metrics, **upstream.breaker.get_metrics()}
+                for name, upstream in cls.instances.items()}
@@ -8,50 +8,76 @@ from passlib.context import CryptContext
 
 from app.config import SETTINGS
 from app.dao.dao import UserDAO
+from app.dao.load_profiles import AUTH_USER
 from app.database import User
-from app.exceptions import CredentialsException, UserNotFoundException
+from app.exceptions import CredentialsException, UserNotFoundException, TooManyLoginAttemptsException
+from app.schemas import UserSnapshot
+from app.utils.password_hasher import PasswordHasher
+from app.utils.rate_limiter import RateLimiter
 
 pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+login_rate_limiter = RateLimiter(SETTINGS.AUTH.LOGIN_RATE_LIMIT_ATTEMPTS,
+                                 SETTINGS.AUTH.LOGIN_RATE_LIMIT_WINDOW_SECONDS)
+
+
+# Functions are run in the pool of PasswordHasher, so they must be picklable module-level functions
+def verify_password_sync(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
-def get_password_hash(password: str) -> str:
+def get_password_hash_sync(password: str) -> str:
     return pwd_context.hash(password)
 
 
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await PasswordHasher.run(verify_password_sync, plain_password, hashed_password)
+
+
+async def get_password_hash(password: str) -> str:
+    return await PasswordHasher.run(get_password_hash_sync, password)
+
+
+def check_login_rate_limit(username: str, request: Request) -> None:
+    if SETTINGS.AUTH.LOGIN_RATE_LIMIT_ATTEMPTS <= 0:
+        return
+    host = request.client.host if request.client else 'unknown'
+    retry_after = login_rate_limiter.hit(f'{host}:{username}')
+    if retry_after is not None:
+        raise TooManyLoginAttemptsException(headers={'Retry-After': str(retry_after)})
+
+
 async def authenticate_user(username: str, password: str) -> User:
-    user = await UserDAO.find_one_or_none(username=username)
+    user = await UserDAO.find_one_or_none(username=username, profile=AUTH_USER)
     if not user:
         raise CredentialsException()
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password(password, user.hashed_password):
         raise CredentialsException()
     return user
 
 
-def create_access_token(user: User) -> str:
+def create_access_token(user: User | UserSnapshot) -> str:
     expire = datetime.now(timezone.utc) + timedelta(minutes=SETTINGS.AUTH.ACCESS_TOKEN_EXPIRE_MINUTES)
     data = {'sub': str(user.id), 'exp': expire, 'type': 'access'}
     encoded_jwt = jwt.encode(data, SETTINGS.AUTH.SECRET_KEY.get_secret_value(), algorithm=SETTINGS.AUTH.ALGORITHM)
     return encoded_jwt
 
 
-def create_refresh_token(user: User) -> str:
+def create_refresh_token(user: User | UserSnapshot) -> str:
     expire = datetime.now(timezone.utc) + timedelta(days=SETTINGS.AUTH.REFRESH_TOKEN_EXPIRE_DAYS)
     data = {'sub': str(user.id), 'exp': expire, 'type': 'refresh'}
     encoded_jwt = jwt.encode(data, SETTINGS.AUTH.SECRET_KEY.get_secret_value(), algorithm=SETTINGS.AUTH.ALGORITHM)
     return encoded_jwt
 
 
-async def get_user_by_token(token: str, token_type: str) -> User:
+async def get_user_by_token(token: str, token_type: str) -> UserSnapshot:
     payload = jwt.decode(token, SETTINGS.AUTH.SECRET_KEY.get_secret_value(),
                          algorithms=[SETTINGS.AUTH.ALGORITHM])
     if payload['type'] != token_type:
         raise InvalidTokenError()
     user_id = payload['sub']
-    user = await UserDAO.find_one_or_none_by_id(uuid.UUID(user_id))
+    user = await UserDAO.find_snapshot_by_id(uuid.UUID(user_id))
     if user is None:
         raise UserNotFoundException()
     return user
@@ -67,12 +93,12 @@ def delete_refresh_token(response: Response) -> None:
     response.delete_cookie(key=SETTINGS.AUTH.REFRESH_TOKEN_COOKIE_NAME)
 
 
-def set_access_token(user: User, response: Response) -> None:
+def set_access_token(user: User | UserSnapshot, response: Response) -> None:
     access_token = create_access_token(user)
     response.set_cookie(key=SETTINGS.AUTH.ACCESS_TOKEN_COOKIE_NAME, value=access_token, httponly=True)
 
 
-def set_refresh_token(user: User, response: Response) -> None:
+def set_refresh_token(user: User | UserSnapshot, response: Response) -> None:
     refresh_token = create_refresh_token(user)
     response.set_cookie(key=SETTINGS.AUTH.REFRESH_TOKEN_COOKIE_NAME, value=refresh_token, httponly=True)
 
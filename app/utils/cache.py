@@ -0,0 +1,93 @@
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Generic, TypeVar, Hashable, Any
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+# In-process cache with a time to live for the items. The least recently used items are removed when it is full
+class TTLCache(Generic[K, V]):
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.items: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        # Incremented by every invalidation. A value read before an invalidation is not stored if the version taken
+        # before the read is passed to set, since it can be outdated
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: K) -> V | None:
+        item = self.items.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self.items[key]
+            self.misses += 1
+            return None
+        self.items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key: K, value: V, version: int | None = None) -> None:
+        if version is not None and version != self.version:
+            return
+        self.items[key] = (time.monotonic() + self.ttl_seconds, value)
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def delete(self, key: K) -> None:
+        self.version += 1
+        self.items.pop(key, None)
+
+    def clear(self) -> None:
+        self.version += 1
+        self.items.clear()
+
+    def get_metrics(self) -> dict[str, int | float]:
+        requests = self.hits + self.misses
+        return {
+            'size': len(self.items),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0
+        }
+
+
+# Storage of cached query results. An external store can be used by implementing this interface,
+# in which case the keys and values must be serialized by the implementation
+class ResultCacheBackend(ABC):
+    @abstractmethod
+    async def get(self, key: Hashable) -> Any | None:
+        pass
+
+    @abstractmethod
+    async def set(self, key: Hashable, value: Any) -> None:
+        pass
+
+    @abstractmethod
+    async def clear(self) -> None:
+        pass
+
+    @abstractmethod
+    def get_metrics(self) -> dict[str, int | float]:
+        pass
+
+
+class MemoryResultCacheBackend(ResultCacheBackend):
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.cache: TTLCache[Hashable, Any] = TTLCache(max_size, ttl_seconds)
+
+    async def get(self, key: Hashable) -> Any | None:
+        return self.cache.get(key)
+
+    async def set(self, key: Hashable, value: Any) -> None:
+        self.cache.set(key, value)
+
+    async def clear(self) -> None:
+        self.cache.clear()
+
+    def get_metrics(self) -> dict[str, int | float]:
+        return self.cache.get_metrics()
@@ -0,0 +1,70 @@
+import base64
+import binascii
+import re
+from dataclasses import dataclass
+
+
+# Content of an image. It is decoded once and the same bytes are shared by everything that uses the image,
+# base64 is made again only for the requests that need it
+@dataclass(frozen=True)
+class ImagePayload:
+    data: bytes
+    content_type: str = 'image/jpeg'
+
+    def to_base64(self) -> bytes:
+        return base64.b64encode(self.data)
+
+    def to_data_url(self) -> bytes:
+        return b''.join((f'data:{self.content_type};base64,'.encode(), self.to_base64()))
+
+
+# Decodes a base64 string field of a JSON document that arrives in chunks, so neither the document nor the base64 text
+# are kept in memory as a whole. The first field with the name is decoded, wherever it is in the document
+class Base64FieldDecoder:
+    # Length of the end of a chunk that is kept when the field is not found in it, in case the name is split
+    # between chunks
+    SEARCH_OVERLAP = 256
+
+    def __init__(self, name: str):
+        self.name = name
+        self.field_start = re.compile(rb'"' + re.escape(name.encode()) + rb'"\s*:\s*"')
+        self.found = False
+        self.done = False
+        self.pending = b''
+        self.output = bytearray()
+
+    def feed(self, chunk: bytes) -> None:
+        if self.done:
+            return
+        data = self.pending + chunk
+        if not self.found:
+            match = self.field_start.search(data)
+            if match is None:
+                self.pending = data[-self.SEARCH_OVERLAP:]
+                return
+            self.found = True
+            data = data[match.end():]
+        end = data.find(b'"')
+        if end != -1:
+            data = data[:end]
+            self.done = True
+        # The only escape JSON allows in base64 is an escaped slash
+        data = data.replace(b'\\/', b'/')
+        if self.done:
+            self.output += binascii.a2b_base64(data, strict_mode=True)
+            self.pending = b''
+            return
+        escape = b''
+        if data.endswith(b'\\'):
+            data, escape = data[:-1], b'\\'
+        # Base64 is decoded by groups of 4 characters, the rest waits for the next chunk
+        complete_length = len(data) - len(data) % 4
+        self.output += binascii.a2b_base64(data[:complete_length], strict_mode=True)
+        self.pending = data[complete_length:] + escape
+
+    def result(self) -> bytes:
+        if not self.done:
+            raise ValueError(f'Field "{self.name}" was not found in the response')
+        data = bytes(self.output)
+        self.output = bytearray()
+        return data
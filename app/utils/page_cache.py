@@ -0,0 +1,68 @@
+import hashlib
+from pathlib import Path
+from typing import Any
+
+from fastapi import Request, Response
+from fastapi.templating import Jinja2Templates
+from markupsafe import Markup
+
+from app.config import SETTINGS, BASE_DIR
+from app.schemas import UserSnapshot
+from app.utils.cache import TTLCache
+
+# Rendered parts of pages that are the same for all users. They are stored by the version of the data they show,
+# so they never have to be invalidated
+fragment_cache: TTLCache[str, Markup] = TTLCache(SETTINGS.CACHE.FRAGMENT_MAX_SIZE,
+                                                 SETTINGS.CACHE.FRAGMENT_TTL_SECONDS)
+
+
+def get_templates_version() -> str:
+    digest = hashlib.sha256()
+    for path in sorted(Path(f'{BASE_DIR}/app/templates').rglob('*.html')):
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+# Pages rendered by another version of the templates must not be considered unchanged
+TEMPLATES_VERSION = get_templates_version()
+
+
+def make_version(*parts: Any) -> str:
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+# Strong ETag of the page. It includes the user, since the navigation bar differs for them
+def make_etag(version: str, current_user: UserSnapshot | None) -> str:
+    user_id = current_user.id if current_user else None
+    return f'"{make_version(TEMPLATES_VERSION, version, user_id)}"'
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is None:
+        return False
+    etags = [value.strip().removeprefix('W/') for value in if_none_match.split(',')]
+    return etag in etags or '*' in etags
+
+
+def set_cache_headers(response: Response, etag: str, current_user: UserSnapshot | None) -> Response:
+    response.headers['ETag'] = etag
+    # Browsers must check the ETag on each visit, pages of logged-in users are not stored by shared caches
+    response.headers['Cache-Control'] = 'private, no-cache' if current_user else 'no-cache'
+    response.headers['Vary'] = 'Cookie'
+    return response
+
+
+def not_modified_response(etag: str, current_user: UserSnapshot | None) -> Response:
+    return set_cache_headers(Response(status_code=304), etag, current_user)
+
+
+def get_fragment(request: Request, name: str, version: str) -> Markup | None:
+    # Links in fragments are absolute, so they depend on the host of the request
+    return fragment_cache.get(f'{name}:{request.base_url}:{version}')
+
+
+def render_fragment(templates: Jinja2Templates, request: Request, name: str, version: str, **context) -> Markup:
+    fragment = Markup(templates.get_template(name).render(request=request, **context))
+    fragment_cache.set(f'{name}:{request.base_url}:{version}', fragment)
+    return fragment
@@ -0,0 +1,33 @@
+import base64
+from datetime import datetime
+from typing import Any, Sequence
+
+from pydantic import BaseModel
+
+
+class Cursor(BaseModel):
+    values: list[Any]
+    backwards: bool = False
+
+
+def encode_cursor(values: Sequence[Any], backwards: bool = False) -> str:
+    values = [value.isoformat() if isinstance(value, datetime) else str(value) for value in values]
+    data = Cursor(values=values, backwards=backwards).model_dump_json()
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+# Returns None for a missing or malformed cursor, so the first page is shown in this case
+def decode_cursor(cursor: str | None, value_types: Sequence[type]) -> Cursor | None:
+    if cursor is None:
+        return None
+    try:
+        decoded_cursor = Cursor.model_validate_json(base64.urlsafe_b64decode(cursor))
+        if len(decoded_cursor.values) != len(value_types):
+            return None
+        decoded_cursor.values = [
+            value_type.fromisoformat(value) if value_type is datetime else value_type(value)
+            for value, value_type in zip(decoded_cursor.values, value_types)
+        ]
+        return decoded_cursor
+    except (ValueError, TypeError):
+        return None
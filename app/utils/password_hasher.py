@@ -0,0 +1,59 @@
+import asyncio
+from collections.abc import Callable
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import TypeVar
+
+from app.config import SETTINGS
+
+T = TypeVar('T')
+
+
+# Password hashing takes hundreds of milliseconds of CPU, so it is run in a pool to not block the event loop.
+# bcrypt releases the GIL, so threads are enough unless other CPU-bound work competes with them
+class PasswordHasher:
+    executor: Executor | None = None
+    semaphore: asyncio.Semaphore | None = None
+    running: int = 0
+    waiting: int = 0
+
+    @classmethod
+    def start(cls) -> None:
+        if SETTINGS.AUTH.HASHING_EXECUTOR == 'process':
+            cls.executor = ProcessPoolExecutor(max_workers=SETTINGS.AUTH.HASHING_WORKERS)
+        else:
+            cls.executor = ThreadPoolExecutor(max_workers=SETTINGS.AUTH.HASHING_WORKERS,
+                                              thread_name_prefix='password_hasher')
+        cls.semaphore = asyncio.Semaphore(SETTINGS.AUTH.HASHING_WORKERS)
+
+    @classmethod
+    def close(cls) -> None:
+        if cls.executor is not None:
+            cls.executor.shutdown(wait=False, cancel_futures=True)
+            cls.executor = None
+
+    @classmethod
+    async def run(cls, function: Callable[..., T], *args) -> T:
+        if cls.executor is None:
+            raise RuntimeError('Password hasher is not started')
+        cls.waiting += 1
+        acquired = False
+        try:
+            async with cls.semaphore:
+                acquired = True
+                cls.waiting -= 1
+                cls.running += 1
+                try:
+                    return await asyncio.get_running_loop().run_in_executor(cls.executor, function, *args)
+                finally:
+                    cls.running -= 1
+        finally:
+            if not acquired:
+                cls.waiting -= 1
+
+    @classmethod
+    def get_metrics(cls) -> dict[str, int]:
+        return {
+            'workers': SETTINGS.AUTH.HASHING_WORKERS,
+            'running': cls.running,
+            'waiting': cls.waiting
+        }
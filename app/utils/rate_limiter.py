@@ -0,0 +1,57 @@
+import asyncio
+import math
+import time
+from collections import deque
+
+from app.utils.cache import TTLCache
+
+
+# Sliding window limiter. Keys without attempts during the window are evicted by the cache
+class RateLimiter:
+    def __init__(self, max_attempts: int, window_seconds: int, max_size: int = 100000):
+        self.max_attempts = max_attempts
+        self.window_seconds = window_seconds
+        self.attempts: TTLCache[str, deque[float]] = TTLCache(max_size, window_seconds)
+
+    # Registers an attempt. Returns the number of seconds to wait if the limit is exceeded
+    def hit(self, key: str) -> int | None:
+        now = time.monotonic()
+        attempts = self.attempts.get(key)
+        if attempts is None:
+            attempts = deque()
+        while attempts and attempts[0] <= now - self.window_seconds:
+            attempts.popleft()
+        if len(attempts) >= self.max_attempts:
+            self.attempts.set(key, attempts)
+            return math.ceil(attempts[0] + self.window_seconds - now)
+        attempts.append(now)
+        self.attempts.set(key, attempts)
+        return None
+
+
+# Token bucket. Tokens are added at a constant rate up to the capacity, so short bursts are allowed while the average
+# rate stays limited. Waiters get tokens in the order they came
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.updated_at) * self.rate, self.capacity)
+        self.updated_at = now
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            self.refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= 1
+
+    def get_tokens(self) -> float:
+        self.refill()
+        return self.tokens
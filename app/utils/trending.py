@@ -0,0 +1,33 @@
+import math
+from datetime import datetime
+
+from app.config import SETTINGS
+
+# The trending score of an image is the logarithm of 1 + the sum of the weights of its likes. The weight of a like
+# doubles every half-life since the epoch, which ranks images the same way as halving the weights of old likes,
+# but the stored scores never have to be decayed. Logarithms keep the numbers small
+TRENDING_EPOCH = datetime(2025, 1, 1)
+
+
+# Logarithm of the weight of a like placed at the given time
+def get_like_weight(liked_at: datetime) -> float:
+    half_lives = (liked_at - TRENDING_EPOCH).total_seconds() / (SETTINGS.TRENDING.HALF_LIFE_HOURS * 3600)
+    return half_lives * math.log(2)
+
+
+# Logarithm of the sum of two values given by their logarithms
+def add_weights(first: float, second: float) -> float:
+    return max(first, second) + math.log1p(math.exp(-abs(first - second)))
+
+
+# Part of a sum of weights that is left after subtracting almost all of it and is treated as a rounding error.
+# The weights are huge numbers, so removing the only like of an image would leave a large remainder instead of 0
+SUBTRACTION_PRECISION = 1e-9
+
+
+# Logarithm of the difference of two values given by their logarithms. The result is not less than 0, the score
+# of an image without likes
+def subtract_weights(first: float, second: float) -> float:
+    if first - second < SUBTRACTION_PRECISION:
+        return 0
+    return max(first + math.log1p(-math.exp(second - first)), 0)